@@ -1,158 +1,493 @@
 # file: ddb_agent/agent.py (之前在main.py中虚构的，现在正式实现)
 
-import json
+import asyncio
+import hashlib
+import io
 import os
-from typing import Generator, List, Dict, Any, Tuple
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import AsyncGenerator, Generator, List, Dict, Any, Tuple
 from agent.code_executor import CodeExecutor
 from agent.coding_task_state import CodingTaskState
 from agent.execution_result import ExecutionResult
-from agent.prompts import debugging_planner, fix_script_from_error, generate_initial_script
-from llm.llm_client import LLMResponse
+from agent.prompts import (
+    async_streaming_chat_prompt, chat_prompt, fix_script_from_error,
+    generate_initial_script, streaming_chat_prompt, streaming_debugging_planner
+)
+from agent.plan_cache import PlanCache
+from agent.semantic_cache import SemanticCache
+from llm.llm_client import MODEL_API_ERROR_PREFIX, LLMResponse
 from session.session_manager import SessionManager
 from context.context_builder import ContextBuilder
+from context.pruner import Document
 from rag.rag_entry import DDBRAG
-from llm.llm_prompt import llm # 假设llm实例在这里
+from rag.reranker import Reranker
+from token_counter import count_tokens
 
 from rich.pretty import pprint
 
 from agent.tool_manager import ToolManager
 from agent.tools.ddb_tools import GetFunctionSignatureTool, RunDolphinDBScriptTool
-from utils.json_parser import parse_json_string
+from utils.json_parser import JsonArrayStreamParser, dumps_json, parse_json_string
+
+
+# 合并执行的脚本中，前面各步骤的错误信息带有 "step_<n>: " 前缀
+_SCRIPT_STEP_ERROR_PREFIX = "step_"
+_SCRIPT_STEP_ERROR_RE = re.compile(rf"{_SCRIPT_STEP_ERROR_PREFIX}(\d+): ")
+# 查询中的字面量：引号字符串和独立的数字 (不含标识符中的数字，如 table1)
+_QUERY_LITERAL_RE = re.compile(r'"[^"\n]*"|\'[^\'\n]*\'|(?<![\w.])\d+(?:\.\d+)?(?![\w.])')
+# 脚本模板中的字面量占位符
+_TEMPLATE_SLOT_RE = re.compile(r'\x00(\d+)\x00')
 
 
 class DDBAgent:
     """
     The main agent orchestrating all components: session, RAG, context, and LLM.
     """
-    def __init__(self, project_path: str, model_name: str, max_window_size: int):
+    # 固定不变的系统提示，保证每轮请求的前缀字节完全一致，以命中服务端的 prompt/prefix 缓存
+    _SYSTEM_PROMPT = "You are a world-class DolphinDB expert. Answer the user's query based on the provided context. If file context is provided, prioritize it. Be concise, accurate, and provide code examples where appropriate."
+
+    RETRIEVAL_CACHE_SIZE = 128
+    # 阈值只控制"问法有多接近"，本身不能保证复用安全：词序由 SemanticCache 检查，对话上下文则通过只缓存会话的第一个问题来排除
+    ANSWER_CACHE_THRESHOLD = 0.97
+    ANSWER_CACHE_SIZE = 1024
+    # 只有普通聊天的回答会被语义缓存；代码类任务的回答依赖最新的执行状态，复用容易过时
+    ANSWER_CACHE_TASK_TYPES = ('chat',)
+    INITIAL_SCRIPT_CACHE_SIZE = 128
+    # 按查询"形状" (字面量被屏蔽后的模板) 缓存的脚本数量
+    SCRIPT_TEMPLATE_CACHE_SIZE = 512
+    # 流式输出的批量大小与最长攒批时间 (秒)
+    STREAM_FLUSH_CHUNKS = 8
+    STREAM_FLUSH_INTERVAL = 0.05
+    # 计划中可并发执行的连续只读步骤数上限，避免压垮 DolphinDB 服务器
+    MAX_PARALLEL_STEPS = 4
+    # 聊天 prompt 在模块级别定义，所有实例共享 (实例上仍可覆盖)
+    chat_prompt_func = staticmethod(chat_prompt)
+    streaming_chat_prompt_func = staticmethod(streaming_chat_prompt)
+    async_streaming_chat_prompt_func = staticmethod(async_streaming_chat_prompt)
+    # 同一脚本以同一错误失败的次数达到该值时，不再重新规划，直接放弃
+    MAX_IDENTICAL_FAILURES = 2
+
+    def __init__(self, project_path: str, model_name: str, max_window_size: int, use_multi_query: bool = False):
         self.project_path = project_path
         self.session_manager = SessionManager(project_path=project_path)
         self.context_builder = ContextBuilder(model_name=model_name, max_window_size=max_window_size)
         self.rag = DDBRAG(project_path=project_path)
+        self.reranker = Reranker()
+        # 开启后，run_task 会生成多个查询变体并行检索，再用 RRF 融合结果 (每轮多一次 LLM 调用)
+        self.use_multi_query = use_multi_query
         self.llm_model_name = model_name
         self.code_executor = CodeExecutor()
         self.tool_manager = ToolManager([
-            RunDolphinDBScriptTool(),
-            GetFunctionSignatureTool()
+            RunDolphinDBScriptTool(executor=self.code_executor),
+            GetFunctionSignatureTool(executor=self.code_executor)
             # 未来可以添加更多工具, e.g., ReadFileTool, ListDirectoryTool
         ])
         self.last_successful_script: str | None = None 
-
-        # 定义一个通用的聊天Prompt
-        @llm.prompt()
-        def _default_chat_prompt(conversation_history: List[Dict[str, str]]):
-            """
-            You are a helpful DolphinDB assistant. Continue the conversation naturally.
-            The user's latest message is the last one in the history.
-            """
-            # 这个函数只用于传递历史，所以返回空字典
-            return {"model": self.llm_model_name}
-        
-        self.chat_prompt_func = _default_chat_prompt
+        # 语义缓存：会话中第一个问题 (不依赖之前的对话) 的近似重复问法直接复用之前的回答，跨会话有效
+        self.semantic_cache = SemanticCache(threshold=self.ANSWER_CACHE_THRESHOLD, max_size=self.ANSWER_CACHE_SIZE)
+        # RAG 检索结果缓存 (LRU)，避免对相同的输入重复检索
+        self._retrieval_cache: OrderedDict[str, List[Document]] = OrderedDict()
+        self._retrieval_lock = threading.Lock()
+        # 近似重复的查询复用检索结果；索引文件发生变化时两级缓存一起失效
+        self._retrieval_semantic_cache = SemanticCache()
+        self._retrieval_index_mtime = self.rag.index_version
+        # (query, rag_context, 索引版本) -> 初始脚本
+        self._initial_script_cache: OrderedDict[str, str] = OrderedDict()
+        self._initial_script_lock = threading.Lock()
+        self._script_template_cache: OrderedDict[str, str] = OrderedDict()
+        # 共享的 I/O 线程池，用于让检索等耗时操作与本地准备工作并行
+        self._io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ddb-io')
+        # 调试计划缓存：相同的 (失败脚本, 错误信息) 直接复用之前生成的计划
+        self._debug_plan_cache: Dict[str, List[Dict[str, Any]]] = {}
+        # 持久化的计划缓存 (初始脚本和调试计划)，重启后仍可复用
+        self.plan_cache = PlanCache()
+        # save_last_script 已经创建过的目录，避免每次保存都重复 makedirs
+        self._known_dirs: set = set()
+
+    def close(self):
+        """Flushes the session and releases the thread pools and database connections."""
+        self.flush_session()
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+        self.tool_manager.close()
+        self.code_executor.close()
+        self.plan_cache.close()
 
     def start_new_session(self):
         """Starts a new chat session."""
+        self.flush_session()
         self.session_manager.new_session()
+        self.clear_retrieval_cache()
 
-    @llm.prompt(stream=True)
-    def _streaming_chat_prompt(self, conversation_history: List[Dict[str, str]]):
-        """       You are a helpful DolphinDB assistant. Continue the conversation naturally.
-        The user's latest message is the last one in the history.
+    def clear_retrieval_cache(self):
+        """Drops all cached retrieval results."""
+        with self._retrieval_lock:
+            self._retrieval_cache.clear()
+        self._retrieval_semantic_cache.clear()
+
+    def _schedule_session_save(self):
         """
-    
-    def _stream_wrapper(self, generator):
-        """一个包装器，用于在流式输出结束后保存历史记录。"""
-        full_content = ""
+        Saves the session without blocking: the session manager's background writer
+        coalesces back-to-back saves into a single write.
+        """
+        self.session_manager.save_session()
+
+    def flush_session(self):
+        """Blocks until any pending background session save has finished."""
+        self.session_manager.flush()
+
+    def _cached_retrieve(self, query: str, top_k: int, multi_query: bool = False) -> List[Document]:
+        """
+        Retrieves documents for `query`, reusing the result of an identical earlier query.
+        With `multi_query`, the query is expanded into variants and the results are fused.
+        """
+        # 索引被重建后，之前的检索结果可能已过时
+        index_mtime = self.rag.index_version
+        if index_mtime != self._retrieval_index_mtime:
+            self.clear_retrieval_cache()
+            self._retrieval_index_mtime = index_mtime
+
+        key = hashlib.blake2b(f"{top_k}:{int(multi_query)}:{query}".encode('utf-8'), digest_size=16).hexdigest()
+        with self._retrieval_lock:
+            if key in self._retrieval_cache:
+                self._retrieval_cache.move_to_end(key)
+                return self._retrieval_cache[key]
+
+        namespace = f"{top_k}:{int(multi_query)}"
+        documents = self._retrieval_semantic_cache.lookup(query, namespace=namespace)
+        if documents is not None:
+            return documents
+
+        if multi_query:
+            queries = [query] + self.rag.generate_query_variants(query, n=3)
+            documents = self.rag.retrieve_multi(queries, top_k=top_k)
+        else:
+            documents = self.rag.retrieve(query, top_k=top_k)
+        with self._retrieval_lock:
+            self._retrieval_cache[key] = documents
+            if len(self._retrieval_cache) > self.RETRIEVAL_CACHE_SIZE:
+                self._retrieval_cache.popitem(last=False)
+        self._retrieval_semantic_cache.put(query, documents, namespace=namespace)
+        return documents
+
+    def _cached_initial_script(self, user_query: str, rag_context: str) -> str:
+        """
+        `generate_initial_script`, memoized in memory and in the plan cache by the query, the RAG
+        context and the index version. Failed LLM calls are not cached.
+        """
+        context_hash = hashlib.blake2b(rag_context.encode('utf-8'), digest_size=16).hexdigest()
+        key = hashlib.blake2b(
+            f"{self.rag.index_version}\0{user_query}\0{context_hash}".encode('utf-8'), digest_size=16
+        ).hexdigest()
+
+        query_template, literals = self._query_template(user_query)
+        template_key = hashlib.blake2b(
+            f"{self.rag.index_version}\0{query_template}\0{context_hash}".encode('utf-8'), digest_size=16
+        ).hexdigest() if literals else None
+
+        with self._initial_script_lock:
+            if key in self._initial_script_cache:
+                self._initial_script_cache.move_to_end(key)
+                return self._initial_script_cache[key]
+            # 同一"形状"的查询 (只有数字/字符串不同) 复用之前生成的脚本，代入本次的字面量
+            if template_key in self._script_template_cache:
+                self._script_template_cache.move_to_end(template_key)
+                script_template = self._script_template_cache[template_key]
+                return _TEMPLATE_SLOT_RE.sub(lambda m: literals[int(m.group(1))], script_template)
+
+        script = self.plan_cache.get(f"script:{key}")
+        if script is None:
+            script = generate_initial_script(user_query=user_query, rag_context=rag_context)
+            if not script or script.startswith(MODEL_API_ERROR_PREFIX):
+                return script
+            self.plan_cache.put(f"script:{key}", script)
+
+        script_template = self._script_template(script, literals) if template_key else None
+
+        with self._initial_script_lock:
+            self._initial_script_cache[key] = script
+            if len(self._initial_script_cache) > self.INITIAL_SCRIPT_CACHE_SIZE:
+                self._initial_script_cache.popitem(last=False)
+            if script_template is not None:
+                self._script_template_cache[template_key] = script_template
+                if len(self._script_template_cache) > self.SCRIPT_TEMPLATE_CACHE_SIZE:
+                    self._script_template_cache.popitem(last=False)
+        return script
+
+    @staticmethod
+    def _query_template(user_query: str) -> Tuple[str, List[str]]:
+        """
+        Masks quoted strings and numbers in the query, e.g. `top 10 rows of "trades"`
+        becomes `top <NUM> rows of <STR>`. Returns the template and the masked literals.
+        """
+        literals = []
+
+        def _mask(match: re.Match) -> str:
+            literals.append(match.group(0))
+            return "<STR>" if match.group(0)[0] in "\"'" else "<NUM>"
+
+        template = " ".join(_QUERY_LITERAL_RE.sub(_mask, user_query).split())
+        return template, literals
+
+    @staticmethod
+    def _script_template(script: str, literals: List[str]) -> str | None:
+        """
+        Replaces each query literal in `script` with a numbered slot. Returns None
+        unless every literal is distinct and occurs exactly once in the script, so
+        that substituting new literals later cannot touch unrelated constants.
+        """
+        if len(set(literals)) != len(literals):
+            return None
+        for index, literal in enumerate(literals):
+            pattern = re.compile(rf'(?<![\w.\x00]){re.escape(literal)}(?![\w.\x00])')
+            script, count = pattern.subn(f"\x00{index}\x00", script)
+            if count != 1:
+                return None
+        return script
+
+    @staticmethod
+    def _format_rag_context(documents: List[Document]) -> str:
+        """Concatenates retrieved documents into a single context string."""
+        # Document.formatted 在 Document 上缓存，检索缓存命中时同一文档无需重复拼接
+        buffer = io.StringIO()
+        for i, doc in enumerate(documents):
+            if i:
+                buffer.write("\n---\n")
+            buffer.write(doc.formatted)
+        return buffer.getvalue()
+
+    def _retrieve_relevant_files(self, query: str) -> List[Document]:
+        """Retrieves a wide candidate set and keeps the top 5 after re-ranking."""
+        if not self.reranker.available:
+            # 没有 cross-encoder 时 rerank 只会截断，直接按检索器的排序取前 5 个，不必多读 25 个文件
+            return self._cached_retrieve(query, top_k=5, multi_query=self.use_multi_query)
+        candidates = self._cached_retrieve(query, top_k=30, multi_query=self.use_multi_query)
+        return self.reranker.rerank(query, candidates, top_n=5)
+
+    def _replay_cached_response(self, response: str):
+        """以流式接口的形式重放一个缓存命中的回答。"""
+        yield response
+        yield LLMResponse(success=True, content=response)
+
+    def _stream_wrapper(self, generator, user_input: str | None = None, task_type: str = 'chat'):
+        """
+        一个包装器，用于在流式输出结束后保存历史记录。
+        文本块会先攒成小批次 (STREAM_FLUSH_CHUNKS 个或 STREAM_FLUSH_INTERVAL 秒) 再向上层 yield，
+        以摊薄每次 yield 的开销。
+        """
+        content_parts: List[str] = []
+        buffer: List[str] = []
+        last_flush = time.monotonic()
         final_meta = None
         for part in generator:
             if isinstance(part, str):
-                full_content += part
-                yield part # 将文本块传递出去
+                buffer.append(part)
+                if len(buffer) >= self.STREAM_FLUSH_CHUNKS or time.monotonic() - last_flush > self.STREAM_FLUSH_INTERVAL:
+                    chunk = "".join(buffer)
+                    buffer.clear()
+                    content_parts.append(chunk)
+                    last_flush = time.monotonic()
+                    yield chunk # 将文本块传递出去
             elif isinstance(part, LLMResponse):
                 final_meta = part
-        
+
+        # 输出缓冲区中剩余的文本
+        if buffer:
+            chunk = "".join(buffer)
+            content_parts.append(chunk)
+            yield chunk
+        full_content = "".join(content_parts)
+
         # 流结束后，保存完整对话
         if final_meta and final_meta.success:
-            self.session_manager.add_message('assistant', full_content)
-            self.session_manager.save_session()
+            self._persist_assistant(full_content, user_input=user_input, task_type=task_type)
         
         # 将最后的元数据也传递出去，以便上层检查错误
         #if final_meta:
         #    yield final_meta
 
-    def run_task(self, user_input: str, task_type: str = 'chat', stream: bool = False) :
+    async def _astream_wrapper(self, agen, user_input: str | None = None, task_type: str = 'chat') -> AsyncGenerator[str, None]:
+        """_stream_wrapper 的异步版本：同样攒批输出，流结束后保存回答。"""
+        content_parts: List[str] = []
+        buffer: List[str] = []
+        last_flush = time.monotonic()
+        final_meta = None
+        async for part in agen:
+            if isinstance(part, str):
+                buffer.append(part)
+                if len(buffer) >= self.STREAM_FLUSH_CHUNKS or time.monotonic() - last_flush > self.STREAM_FLUSH_INTERVAL:
+                    chunk = "".join(buffer)
+                    buffer.clear()
+                    content_parts.append(chunk)
+                    last_flush = time.monotonic()
+                    yield chunk
+            elif isinstance(part, LLMResponse):
+                final_meta = part
+
+        if buffer:
+            chunk = "".join(buffer)
+            content_parts.append(chunk)
+            yield chunk
+
+        # 会话写盘已经在后台线程中进行，这里不会阻塞事件循环
+        if final_meta and final_meta.success:
+            self._persist_assistant("".join(content_parts), user_input=user_input, task_type=task_type)
+
+    def _persist_assistant(self, response: str, user_input: str | None = None, task_type: str = 'chat'):
         """
-        Handles a user request by orchestrating RAG, context building, and LLM interaction.
+        Records the assistant's reply for the current turn exactly once: appends it to the
+        history, schedules a session save and, if `user_input` is given, caches the answer.
         """
-        # 1. 更新会话历史
-        self.session_manager.add_message('user', user_input)
-        full_conversation_history = self.session_manager.get_history()
+        history = self.session_manager.get_history()
+        if not history or history[-1]['role'] != 'user':
+            # 同一轮的回答已经保存过 (例如同一个 agent 上重叠执行了两个 run_task_async)：
+            # 不再重复追加，也不缓存，避免历史中出现连续的 assistant 消息
+            print("Warning: No pending user message for this reply; it was already persisted. Skipping.")
+            return
+        # 是否可缓存要在追加回答之前判断，与查找时看到的历史一致
+        cache_answer = (
+            user_input is not None
+            and not response.startswith(MODEL_API_ERROR_PREFIX)
+            and self._answer_cache_applies(task_type)
+        )
+        self.session_manager.add_message('assistant', response)
+        self._schedule_session_save()
+        if cache_answer:
+            self.semantic_cache.put(user_input, response, namespace=task_type, context=self._answer_cache_context())
+
+    def _answer_cache_applies(self, task_type: str) -> bool:
+        """
+        Answers are only cached for standalone questions: the first message of a session
+        in a cached task type. A follow-up like "explain it" depends on the turns before
+        it, so it is never looked up or stored.
+        """
+        return task_type in self.ANSWER_CACHE_TASK_TYPES and len(self.session_manager.get_history()) == 1
+
+    def _answer_cache_context(self) -> str:
+        """Answers depend on the retrieved files, so a rebuilt index invalidates them."""
+        return str(self.rag.index_version)
 
+    def _lookup_cached_answer(self, user_input: str, task_type: str) -> str | None:
+        """Returns a cached answer to a near-identical earlier standalone question, if caching applies."""
+        if not self._answer_cache_applies(task_type):
+            return None
+        return self.semantic_cache.lookup(user_input, namespace=task_type, context=self._answer_cache_context())
+
+    def _build_task_messages(self, user_input: str, task_type: str) -> List[Dict[str, str]]:
+        """Retrieves relevant files and builds the pruned message list for the current turn."""
         # 2. 使用 RAG 检索相关文件上下文
-        # 我们用最新的用户输入去检索
-        relevant_files = self.rag.retrieve(user_input, top_k=5)
+        # 我们用最新的用户输入去检索，先多召回一些候选，再用 reranker 精排出 top 5。
+        # 检索与历史无关，放到后台线程中执行，同时在当前线程准备对话历史
+        retrieval_future = self._io_pool.submit(self._retrieve_relevant_files, user_input)
+        full_conversation_history = self.session_manager.get_history()
+        relevant_files = retrieval_future.result()
 
-        # 3. 准备构建上下文所需的所有材料
-        system_prompt = "You are a world-class DolphinDB expert. Answer the user's query based on the provided context. If file context is provided, prioritize it. Be concise, accurate, and provide code examples where appropriate."
-        
-        # 4. 使用 ContextBuilder 构建最终的、经过剪枝的上下文
-        # 注意：我们将完整的历史和检索到的文件都传给它
-        final_messages = self.context_builder.build(
-            system_prompt=system_prompt,
+        # 3. 使用 ContextBuilder 构建最终的、经过剪枝的上下文
+        # 注意：我们将完整的历史和检索到的文件都传给它；系统提示保持不变，作为稳定的缓存前缀。
+        # 剪枝策略按上下文的实际大小分层选择，小上下文无需调用 LLM 抽取
+        pruning_strategy = self.context_builder.select_file_pruning_strategy(
+            system_prompt=self._SYSTEM_PROMPT,
+            conversations=full_conversation_history,
+            file_sources=relevant_files
+        )
+        return self.context_builder.build(
+            system_prompt=self._SYSTEM_PROMPT,
             conversations=full_conversation_history,
             file_sources=relevant_files,
             task_type=task_type,
-            file_pruning_strategy='extract'
+            file_pruning_strategy=pruning_strategy
         )
+
+    def run_task(self, user_input: str, task_type: str = 'chat', stream: bool = False) :
+        """
+        Handles a user request by orchestrating RAG, context building, and LLM interaction.
+        """
+        # 1. 更新会话历史
+        self.session_manager.add_message('user', user_input)
+
+        # 语义缓存命中时跳过 RAG 和 LLM 调用，直接复用之前的回答
+        cached_response = self._lookup_cached_answer(user_input, task_type)
+        if cached_response is not None:
+            if stream:
+                return self._stream_wrapper(self._replay_cached_response(cached_response))
+            self._persist_assistant(cached_response)
+            return cached_response
+
+        # 2-3. RAG 检索并构建上下文
+        final_messages = self._build_task_messages(user_input, task_type)
         
-        # 5. 调用 LLM
+        # 4. 调用 LLM
         # 这里我们不再使用简单的 chat_oai，而是利用我们之前设计的 llm.prompt 框架
         # 来调用一个带有完整、剪枝后历史的 prompt 函数。
         # 注意：这里我们不再需要一个复杂的模板，因为所有上下文都已在 message 列表中。
         # 我们只需一个简单的函数来触发调用。
 
         if stream:
-            response_generator = self._streaming_chat_prompt(
-                conversation_history=final_messages
-            )
-            return self._stream_wrapper(response_generator)
-        else:
-            assistant_response = self.chat_prompt_func(
+            response_generator = self.streaming_chat_prompt_func(
                 conversation_history=final_messages
             )
+            # 流式模式下由 _stream_wrapper 在流结束后保存回答
+            return self._stream_wrapper(response_generator, user_input=user_input, task_type=task_type)
 
-        # 6. 更新会话并保存
-        self.session_manager.add_message('assistant', assistant_response)
-        self.session_manager.save_session()
+        assistant_response = self.chat_prompt_func(
+            conversation_history=final_messages
+        )
+
+        # 5. 更新会话并保存
+        self._persist_assistant(assistant_response, user_input=user_input, task_type=task_type)
 
         return assistant_response
     
+    async def run_task_async(self, user_input: str, task_type: str = 'chat') -> AsyncGenerator[str, None]:
+        """
+        Streaming `run_task` for asyncio callers. Retrieval and context building run in a
+        worker thread and the LLM response is read with the async client, so several
+        requests (or other LLM calls) can be in flight on one event loop.
+        """
+        self.session_manager.add_message('user', user_input)
+
+        cached_response = self._lookup_cached_answer(user_input, task_type)
+        if cached_response is not None:
+            yield cached_response
+            self._persist_assistant(cached_response)
+            return
+
+        final_messages = await asyncio.to_thread(self._build_task_messages, user_input, task_type)
+        response_agen = self.async_streaming_chat_prompt_func(conversation_history=final_messages)
+        async for chunk in self._astream_wrapper(response_agen, user_input=user_input, task_type=task_type):
+            yield chunk
+
     def run_coding_task(self, user_input: str):
         """
         Orchestrates the iterative process of generating, executing, and fixing code.
         """
         print(f"--- Starting new coding task for: '{user_input}' ---")
+        # reranker 模型的加载与本任务的 RAG、LLM 调用和脚本执行重叠进行，后续 run_task 无需再等待
+        self._io_pool.submit(self.reranker.warmup)
+        # 数据库连接在 RAG 和脚本生成期间建立，首次执行脚本时无需再等待连接和登录
+        self._io_pool.submit(self.code_executor.warmup)
 
         # 1. 初始 RAG
         print("Step 1: Retrieving context with RAG...")
-        initial_context = self.rag.retrieve(user_input, top_k=5)
+        initial_context = self._cached_retrieve(user_input, top_k=5)
         # 将 Document 列表转换为单个字符串
-        context_str = "\n---\n".join(
-            f"File: {doc.file_path}\n\n{doc.source_code}" for doc in initial_context
-        )
+        context_str = self._format_rag_context(initial_context)
 
         # 2. 初始化任务状态
+        # rag_context 在整个修正循环中保持不变，作为每次 LLM 调用的稳定前缀；其 token 数只计算一次
         state = CodingTaskState(
             original_query=user_input,
-            rag_context=context_str
+            rag_context=context_str,
+            rag_context_tokens=count_tokens(context_str, self.llm_model_name)
         )
+        print(f"RAG context: {len(initial_context)} files, {state.rag_context_tokens} tokens.")
 
         # 3. 生成第一版脚本
         print("Step 2: Generating initial script...")
-        state.current_code = generate_initial_script(
-            user_query=state.original_query,
-            rag_context=state.rag_context
-        )
+        state.current_code = self._cached_initial_script(state.original_query, state.rag_context)
         print(f"Initial script generated:\n{state.current_code}")
 
         # 4. 进入核心的 "执行-修正" 循环
@@ -188,7 +523,8 @@ class DDBAgent:
                 original_query=state.original_query,
                 failed_code=state.current_code,
                 error_message=last_error,
-                rag_context=state.rag_context # 使用更新后的上下文
+                rag_context=state.rag_context, # 原样传递，保证前缀缓存命中
+                error_summary=state.error_summary
             )
             print(f"Generated new corrected script:\n{state.current_code}")
             
@@ -198,19 +534,154 @@ class DDBAgent:
         print("❌ Task Failed after maximum attempts.")
         return state.execution_history[-1] # 返回最后一次的失败结果
     
+    def _parallel_step_batch(self, plan: List[Dict[str, Any]], start: int, completed: set) -> List[int]:
+        """
+        Returns the indices of the steps that are ready to run together with the step at `start`.
+
+        Step args are fixed when the plan is made, so parallel-safe (read-only) steps
+        depend on nothing; the other steps depend on every step before them. If the
+        step at `start` is parallel-safe, every pending parallel-safe step in the rest
+        of the plan is therefore ready (at most MAX_PARALLEL_STEPS of them).
+        """
+        if not self.tool_manager.is_parallel_safe(plan[start]["action"]):
+            return []
+        return self._ready_parallel_steps(plan, start, completed)
+
+    def _ready_parallel_steps(self, plan: List[Dict[str, Any]], start: int, completed: set) -> List[int]:
+        """Returns the indices of the pending parallel-safe steps from `start` on (at most MAX_PARALLEL_STEPS)."""
+        ready = []
+        for index in range(start, len(plan)):
+            if index not in completed and self.tool_manager.is_parallel_safe(plan[index]["action"]):
+                ready.append(index)
+                if len(ready) == self.MAX_PARALLEL_STEPS:
+                    break
+        return ready
+
+    def _submit_steps(self, plan: List[Dict[str, Any]], indices: List[int]) -> Dict[Future, List[int]]:
+        """
+        Submits the given steps to the I/O pool. Steps that call the same tool are
+        submitted as one `call_tool_batch` job (e.g. several `help` lookups in one
+        round-trip). Returns a mapping of future -> the step indices it serves, in
+        the same order as the list of ToolResults the future returns.
+        """
+        groups: Dict[str, List[int]] = {}
+        for index in indices:
+            groups.setdefault(plan[index]["action"], []).append(index)
+        return {
+            self._io_pool.submit(
+                self.tool_manager.call_tool_batch, action, [plan[index]["args"] for index in group]
+            ): group
+            for action, group in groups.items()
+        }
+
+    def _prefetch_ready_steps(self, plan: List[Dict[str, Any]], start: int, completed: set) -> Dict[Future, List[int]]:
+        """
+        Submits the pending read-only steps from `start` on (at most MAX_PARALLEL_STEPS)
+        to the I/O pool, so they run while the current serial step is executing.
+        """
+        return self._submit_steps(plan, self._ready_parallel_steps(plan, start, completed))
+
+    def _collect_prefetched_steps(
+        self,
+        plan: List[Dict[str, Any]],
+        prefetched: Dict[Future, List[int]],
+        execution_context: Dict[str, Any],
+        completed: set
+    ) -> Generator[Dict[str, Any], None, None]:
+        """Waits for the prefetched steps and yields their events in plan order."""
+        pending = sorted(
+            (index, future, position)
+            for future, group in prefetched.items()
+            for position, index in enumerate(group)
+        )
+        for index, future, position in pending:
+            step = plan[index]
+            yield {"type": "step_start", "step": index + 1, "thought": step["thought"], "action": step["action"], "args": step["args"]}
+            tool_result = future.result()[position]
+            yield {"type": "step_result", "step": index + 1, "observation": tool_result.observation}
+            execution_context[f"step_{index + 1}_result"] = tool_result.raw
+            completed.add(index)
+
+    def _call_tool_with_progress(self, action: str, args: Dict[str, Any], step: int):
+        """Runs a tool, yielding `step_partial` events while it runs; returns the ToolResult."""
+        tool_stream = self.tool_manager.call_tool_streaming(action, args)
+        while True:
+            try:
+                chunk = next(tool_stream)
+            except StopIteration as stop:
+                return stop.value
+            yield {"type": "step_partial", "step": step, "chunk": chunk}
+
+    @staticmethod
+    def _script_step_run(plan: List[Dict[str, Any]], start: int) -> List[Dict[str, Any]]:
+        """Returns the run of consecutive `run_dolphindb_script` steps starting at `start`."""
+        run = []
+        for step in plan[start:]:
+            if step.get("action") != "run_dolphindb_script" or "script" not in step.get("args", {}):
+                break
+            run.append(step)
+        return run
+
+    @staticmethod
+    def _merge_script_steps(steps: List[Dict[str, Any]], start: int) -> str:
+        """
+        Joins several scripts into one. Every script but the last is wrapped in a
+        try/catch that prefixes the error with its step number, so a failure can be
+        attributed to the step that caused it; the last one is left as is so that
+        its value is still the value of the whole script.
+        """
+        parts = []
+        for offset, step in enumerate(steps[:-1]):
+            parts.append(
+                f"try {{\n{step['args']['script']}\n}} catch(ex) {{\n"
+                f"    throw \"{_SCRIPT_STEP_ERROR_PREFIX}{start + offset + 1}: \" + ex[1]\n}}"
+            )
+        parts.append(steps[-1]["args"]["script"])
+        return "\n".join(parts)
+
+    @staticmethod
+    def _failed_script_offset(tool_result, start: int, run_length: int) -> int | None:
+        """
+        Returns the offset (within the run) of the step whose result `tool_result`
+        represents: the last step on success, the failing step on error, or None
+        if the merged script could not be parsed at all (nothing was executed).
+        """
+        if tool_result.success:
+            return run_length - 1
+        error = tool_result.error or ""
+        match = _SCRIPT_STEP_ERROR_RE.search(error)
+        if match:
+            offset = int(match.group(1)) - start - 1
+            if 0 <= offset < run_length:
+                return offset
+        if "Syntax Error" in error:
+            return None
+        return run_length - 1
+
     def run_coding_task_with_planner(self, user_input: str) -> Generator[Dict[str, Any], None, None]:
         """
         Orchestrates the plan-and-execute loop for a coding task, yielding state updates.
         """
+        # 1. RAG 检索在后台线程中进行，不阻塞状态更新的输出
+        rag_future = self._io_pool.submit(self._cached_retrieve, user_input, 5)
+        # 与 RAG 和初始脚本生成并行：提前建立数据库连接
+        self._io_pool.submit(self.code_executor.warmup)
         yield {"type": "status", "message": "Starting new PLAN-and-EXECUTE coding task..."}
+        yield {"type": "status", "message": "Retrieving context..."}
 
+        try:
+            rag_context = self._format_rag_context(rag_future.result())
+        except Exception as e:
+            # 检索失败不应中断任务，退化为无上下文生成
+            print(f"Warning: RAG retrieval failed, continuing without context: {e}")
+            rag_context = ""
 
         # 2. 生成初始计划
         yield {"type": "status", "message": "Generating initial plan..."}
         # 这里我们简化，直接生成一个包含run_dolphindb_script的计划
         # 实际中可能需要一个Planner来生成
         try:
-            initial_script = generate_initial_script(user_query=user_input, rag_context="...") # 假设有rag_context
+            initial_script = self._cached_initial_script(user_input, rag_context)
             plan = [
                 {
                     "step": 1, 
@@ -227,64 +698,165 @@ class DDBAgent:
         # 3. 执行计划循环
         step_index = 0
         execution_context = {}
+        failure_counts: Dict[str, int] = {}
+        batch_scripts = True
+        # 当前计划中已经执行完的步骤下标
+        completed_steps: set = set()
+        # 本次新生成、尚未持久化的调试计划：(指纹, 计划)，只有任务最终成功才写入计划缓存
+        pending_debug_plan = None
 
         while step_index < len(plan):
-            current_step = plan[step_index]
-            action = current_step["action"]
-            args = current_step["args"]
-            thought = current_step["thought"]
-            
-            # Yield 当前步骤的思考过程
-            yield {"type": "step_start", "step": step_index + 1, "thought": thought, "action": action, "args": args}
+            if step_index in completed_steps:
+                # 已经提前和其他只读步骤一起执行过
+                step_index += 1
+                continue
+
+            # 只读步骤 (如查询函数签名) 不依赖其他步骤，计划中所有待执行的只读步骤一起并发执行
+            batch = self._parallel_step_batch(plan, step_index, completed_steps)
+            if len(batch) > 1:
+                for index in batch:
+                    step = plan[index]
+                    yield {"type": "step_start", "step": index + 1, "thought": step["thought"], "action": step["action"], "args": step["args"]}
+                futures = self._submit_steps(plan, batch)
+                for future in as_completed(futures):
+                    for index, tool_result in zip(futures[future], future.result()):
+                        yield {"type": "step_result", "step": index + 1, "observation": tool_result.observation}
+                        execution_context[f"step_{index + 1}_result"] = tool_result.raw
+                completed_steps.update(batch)
+                continue
+
+            # 当前步骤需要串行执行；后面待执行的只读步骤不依赖它，提前提交到线程池与它重叠执行
+            prefetched = self._prefetch_ready_steps(plan, step_index + 1, completed_steps)
+
+            # 连续的脚本步骤合并成一个脚本，一次往返执行完
+            script_run = self._script_step_run(plan, step_index) if batch_scripts else []
+            if len(script_run) > 1:
+                for offset, step in enumerate(script_run):
+                    yield {"type": "step_start", "step": step_index + offset + 1, "thought": step["thought"], "action": step["action"], "args": step["args"]}
+                merged_script = self._merge_script_steps(script_run, step_index)
+                tool_result = yield from self._call_tool_with_progress(
+                    "run_dolphindb_script", {"script": merged_script}, step_index + len(script_run)
+                )
+                failed_offset = self._failed_script_offset(tool_result, step_index, len(script_run))
+                if failed_offset is None:
+                    # 脚本整体无法解析，其中任何一步都没有执行：退回到逐步执行
+                    batch_scripts = False
+                    yield {"type": "status", "message": "Batched script could not be parsed, executing steps one by one."}
+                    yield from self._collect_prefetched_steps(plan, prefetched, execution_context, completed_steps)
+                    continue
+                for offset in range(failed_offset):
+                    yield {"type": "step_result", "step": step_index + offset + 1, "observation": "Executed as part of a batched script."}
+                step_index += failed_offset
+                current_step = plan[step_index]
+                action = current_step["action"]
+                args = current_step["args"]
+                if tool_result.success and isinstance(tool_result.raw, ExecutionResult):
+                    # 记录的脚本使用未包装的原始脚本，便于保存和复用
+                    plain_script = "\n".join(step["args"]["script"] for step in script_run)
+                    tool_result.raw = tool_result.raw.model_copy(update={"executed_script": plain_script})
+            else:
+                current_step = plan[step_index]
+                action = current_step["action"]
+                args = current_step["args"]
+                thought = current_step["thought"]
+                
+                # Yield 当前步骤的思考过程
+                yield {"type": "step_start", "step": step_index + 1, "thought": thought, "action": action, "args": args}
 
-            # 执行工具调用
-            tool_result = self.tool_manager.call_tool(action, args)
+                # 执行工具调用
+                # 长时间运行的工具 (如耗时的查询) 在执行期间持续输出进度
+                tool_result = yield from self._call_tool_with_progress(action, args, step_index + 1)
 
-            is_success = True
-            if isinstance(tool_result, ExecutionResult):
-                observation_str = str(tool_result.data) if tool_result.success else f"Execution failed. Error:\n{tool_result.error_message}"
-                is_success = tool_result.success
-            else: # It's a string from another tool like get_function_signature
-                observation_str = str(tool_result)
+            yield {"type": "step_result", "step": step_index + 1, "observation": tool_result.observation}
 
-            yield {"type": "step_result", "step": step_index + 1, "observation": observation_str}
+            # 直接使用结构化的错误信息，不再从渲染后的 observation 中解析
+            error_message = (tool_result.error or "") if not tool_result.success else None
 
-            
             # 检查是否需要启动调试子流程
-            if action == "run_dolphindb_script" and  not is_success:
+            if action == "run_dolphindb_script" and error_message is not None:
                 yield {"type": "status", "message": "Execution failed. Entering debugging sub-task..."}
+                # 当前计划将被替换，提前执行的只读步骤的结果不再需要
+                for future in prefetched:
+                    future.cancel()
                 
                 failed_code = args["script"]
-                error_message = observation_str.split("Error:\n", 1)[1]
-                tool_defs_str = json.dumps(self.tool_manager.get_tool_definitions(), indent=2)
 
+                failure_key = hashlib.blake2b(
+                    f"{failed_code}\0{error_message}".encode('utf-8'), digest_size=16
+                ).hexdigest()
+                failure_counts[failure_key] = failure_counts.get(failure_key, 0) + 1
+                if failure_counts[failure_key] >= self.MAX_IDENTICAL_FAILURES:
+                    # 重新规划后又回到了同样的失败，继续循环只会得到同样的计划
+                    yield {"type": "error", "message": "The same script failed with the same error again. Stopping to avoid a retry loop."}
+                    return
+
+                pending_debug_plan = None
                 try:
-                    # 调用调试Planner
-                    new_plan_str = debugging_planner(
-                        original_query=user_input,
-                        failed_code=failed_code,
-                        error_message=error_message,
-                        tool_definitions=tool_defs_str
-                    )
-                    new_plan = parse_json_string(new_plan_str)
+                    plan_fingerprint = "debug:" + hashlib.blake2b(
+                        f"{failure_key}\0{user_input}\0{self.tool_manager.definitions_digest}".encode('utf-8'),
+                        digest_size=16
+                    ).hexdigest()
+                    if failure_key in self._debug_plan_cache:
+                        new_plan = self._debug_plan_cache[failure_key]
+                        yield {"type": "status", "message": "Reusing cached debug plan"}
+                    elif (cached_plan_json := self.plan_cache.get(plan_fingerprint)) is not None:
+                        new_plan = parse_json_string(cached_plan_json)
+                        self._debug_plan_cache[failure_key] = new_plan
+                        yield {"type": "status", "message": "Reusing cached debug plan"}
+                    else:
+                        # 调用调试Planner (流式)：每个步骤生成完毕就先解析出来，在计划剩余部分生成期间做准备工作
+                        new_plan_str = ""
+                        stream_parser = JsonArrayStreamParser()
+                        warmed_up = False
+                        for chunk in streaming_debugging_planner(
+                            original_query=user_input,
+                            failed_code=failed_code,
+                            error_message=error_message,
+                            tool_definitions=self.tool_manager.definitions_json
+                        ):
+                            if isinstance(chunk, LLMResponse):
+                                new_plan_str = chunk.content if chunk.success else chunk.error_message
+                                break
+                            for planned_step in stream_parser.feed(chunk):
+                                if planned_step.get("action") == "run_dolphindb_script" and not warmed_up:
+                                    # 计划中有脚本要执行：提前建立好数据库连接
+                                    self._io_pool.submit(self.code_executor.warmup)
+                                    warmed_up = True
+                                yield {"type": "status", "message": f"Planned step {planned_step.get('step', '?')}: {planned_step.get('action', 'N/A')}"}
+                        new_plan = parse_json_string(new_plan_str or "")
+                        if isinstance(new_plan, dict):
+                            # JSON 输出模式下计划被包装为 {"plan": [...]}
+                            new_plan = new_plan.get("plan")
+                        if not isinstance(new_plan, list) or not new_plan:
+                            raise ValueError(f"Debugging planner returned an invalid plan: {new_plan_str}")
+                        self._debug_plan_cache[failure_key] = new_plan
+                        pending_debug_plan = (plan_fingerprint, new_plan)
 
                     # Yield 新的调试计划
                     yield {"type": "plan", "plan": new_plan, "message": "Generated a new debugging plan."}
                     
                     plan = new_plan
                     step_index = 0
+                    batch_scripts = True
+                    completed_steps = set()
+                    # 旧计划各步骤的结果 (可能是很大的表) 不再需要，释放掉，避免在整个任务期间常驻内存
+                    execution_context = {}
                     continue # 重置循环，从新计划的第一步开始
                 except Exception as e:
                     yield {"type": "error", "message": f"Failed to generate debugging plan: {e}"}
                     return
 
-            execution_context[f"step_{step_index + 1}_result"] = tool_result
+            execution_context[f"step_{step_index + 1}_result"] = tool_result.raw
+            yield from self._collect_prefetched_steps(plan, prefetched, execution_context, completed_steps)
             step_index += 1
         
         final_result_obj = execution_context.get(f"step_{len(plan)}_result")
 
         if final_result_obj and isinstance(final_result_obj, ExecutionResult) and final_result_obj.success:
             self.last_successful_script = final_result_obj.executed_script 
+            # 只持久化确实修复了问题的调试计划
+            if pending_debug_plan is not None:
+                self.plan_cache.put(pending_debug_plan[0], dumps_json(pending_debug_plan[1]))
         else:
             # If the task fails or doesn't end with a script, clear the last script
             self.last_successful_script = None 
@@ -303,10 +875,20 @@ class DDBAgent:
         
         try:
             # Create directories if they don't exist
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(self.last_successful_script)
+            dir_path = os.path.dirname(file_path)
+            if dir_path and dir_path not in self._known_dirs:
+                os.makedirs(dir_path, exist_ok=True)
+                self._known_dirs.add(dir_path)
+
+            # 脚本很小，直接一次 os.write 写入，绕过 Python 的缓冲 I/O 层
+            data = self.last_successful_script.encode('utf-8')
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
             
             return True, f"Script successfully saved to: {file_path}"
         except Exception as e:
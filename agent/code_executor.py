@@ -1,8 +1,14 @@
 # file: agent/code_executor.py
 
+import hashlib
 import os
+import queue
+import re
+import threading
 import time
-from typing import Optional
+import weakref
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 
 from agent.execution_result import ExecutionResult
@@ -11,26 +17,67 @@ from db.database_session import DatabaseSession # 假设您的文件路径是这
 # 加载环境变量，以便安全地获取数据库凭证
 load_dotenv()
 
+# `use` 导入的模块无法在会话中撤销，执行过这类脚本的连接不再放回连接池
+_USE_MODULE_RE = re.compile(r'^\s*use\s+\w', re.MULTILINE)
+# 会改变服务端可见的函数/模块的脚本：执行成功后，之前缓存的解析错误可能已不再成立
+_SERVER_STATE_CHANGE_RE = re.compile(r'\b(?:loadPlugin|installPlugin|loadModule|saveModule|addFunctionView)\b')
+
+def _close_idle_sessions(idle_sessions: "queue.Queue"):
+    """Closes every idle pooled connection. Runs when the CodeExecutor is garbage-collected or at exit."""
+    while True:
+        try:
+            db_session = idle_sessions.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            db_session.close()
+        except Exception:
+            pass
+
 class CodeExecutor:
     """
     Safely executes DolphinDB scripts and returns structured results.
     It encapsulates the database session management.
     """
+    # 纯词法/语法错误的脚本在服务端什么都没有执行，结果只取决于脚本本身，可以按内容缓存
+    PARSE_ERROR_MARKER = "Syntax Error"
+    # DolphinDB 把无法解析的函数名/模块名也报告为 Syntax Error，但这取决于服务端状态
+    # (函数视图、插件、模块)，状态变化后同一脚本可能变为有效，这类错误不缓存
+    UNRESOLVED_NAME_MARKERS = ("Cannot recognize the token",)
+    PARSE_ERROR_CACHE_SIZE = 256
+    # 缓存的解析错误最多复用这么多秒
+    PARSE_ERROR_CACHE_TTL = 300.0
+    # 连接池已满时，每隔这么多秒重新检查一次是否有连接被丢弃而腾出名额
+    ACQUIRE_POLL_INTERVAL = 0.5
     def __init__(self, 
                  host: Optional[str] = None, 
                  port: Optional[int] = None, 
                  user: Optional[str] = None, 
                  password: Optional[str] = None, 
-                 logger=None):
+                 logger=None,
+                 pool_size: Optional[int] = None):
         """
         Initializes the CodeExecutor. Credentials can be passed directly or
         loaded from environment variables (DDB_HOST, DDB_PORT, DDB_USER, DDB_PASSWORD).
+        Connections are pooled and reused across runs; the pool size defaults to
+        DDB_POOL_SIZE (4).
         """
         self.host = host or os.getenv("DDB_HOST")
         self.port = port or int(os.getenv("DDB_PORT", "8848")) # Provide a default port
         self.user = user or os.getenv("DDB_USER", "admin")
         self.password = password or os.getenv("DDB_PASSWORD", "123456") #
         self.logger = logger
+        self.pool_size = pool_size or int(os.getenv("DDB_POOL_SIZE", "4"))
+
+        # 空闲连接队列；连接在首次需要时才建立，最多 pool_size 个
+        self._idle_sessions: "queue.Queue[DatabaseSession]" = queue.Queue()
+        self._open_sessions = 0
+        self._pool_lock = threading.Lock()
+        # 脚本内容哈希 -> (解析失败的结果, 缓存时间)；调试循环中原样重试同一个脚本时直接返回
+        self._parse_error_cache: "OrderedDict[str, Tuple[ExecutionResult, float]]" = OrderedDict()
+        self._parse_error_lock = threading.Lock()
+        # 对象被回收或进程退出时关闭空闲连接；finalize 不持有 self，不会让 executor 一直存活
+        self._finalizer = weakref.finalize(self, _close_idle_sessions, self._idle_sessions)
 
         if not all([self.host, self.port, self.user, self.password]):
             raise ValueError(
@@ -41,6 +88,112 @@ class CodeExecutor:
         if self.logger:
             self.logger.info(f"CodeExecutor initialized for DolphinDB at {self.host}:{self.port}")
 
+    def _acquire_session(self) -> DatabaseSession:
+        """Takes an idle pooled connection, opening a new one if the pool is not full yet."""
+        while True:
+            try:
+                return self._idle_sessions.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._pool_lock:
+                can_open = self._open_sessions < self.pool_size
+                if can_open:
+                    self._open_sessions += 1
+            if can_open:
+                break
+            # 连接已全部被占用，等待其他调用归还；
+            # 被丢弃的连接不会归还，超时后重新检查是否有空出的名额，避免永久阻塞
+            try:
+                return self._idle_sessions.get(timeout=self.ACQUIRE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+        try:
+            return DatabaseSession(self.host, self.port, self.user, self.password, logger=self.logger).connect()
+        except Exception:
+            with self._pool_lock:
+                self._open_sessions -= 1
+            raise
+
+    def warmup(self):
+        """
+        Opens a pooled connection ahead of time when none is idle, so the next `run`
+        does not wait for connect and login. Safe to call from a background thread.
+        """
+        if not self._idle_sessions.empty():
+            return
+        with self._pool_lock:
+            if self._open_sessions >= self.pool_size:
+                return
+        try:
+            # 还没执行过任何脚本的连接无需重置，直接放入连接池
+            self._idle_sessions.put(self._acquire_session())
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Could not pre-open a DolphinDB connection: {e}")
+
+    def _release_session(self, db_session: DatabaseSession, reusable: bool = True):
+        """
+        Returns a connection to the pool after clearing the variables and functions the
+        last script defined, so results never depend on which pooled connection a script
+        gets. Connections that cannot be reset are closed instead.
+        """
+        if reusable:
+            try:
+                db_session.reset()
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning(f"Could not reset a pooled DolphinDB connection, closing it: {e}")
+                reusable = False
+        if not reusable:
+            self._discard_session(db_session)
+            return
+        self._idle_sessions.put(db_session)
+
+    def _reopen_session(self, db_session: DatabaseSession) -> DatabaseSession:
+        """Closes a broken connection and opens a fresh one in its place in the pool."""
+        try:
+            db_session.close()
+        except Exception:
+            pass
+        try:
+            return DatabaseSession(self.host, self.port, self.user, self.password, logger=self.logger).connect()
+        except Exception:
+            with self._pool_lock:
+                self._open_sessions -= 1
+            raise
+
+    def _discard_session(self, db_session: DatabaseSession):
+        """Closes a connection that is no longer usable instead of returning it to the pool."""
+        try:
+            db_session.close()
+        except Exception:
+            pass
+        with self._pool_lock:
+            self._open_sessions -= 1
+
+    def close(self):
+        """Closes all idle pooled connections."""
+        while True:
+            try:
+                db_session = self._idle_sessions.get_nowait()
+            except queue.Empty:
+                break
+            self._discard_session(db_session)
+
+    def _is_pure_parse_error(self, error_str: str) -> bool:
+        """True for lexical/syntax errors that depend only on the script text."""
+        return (
+            self.PARSE_ERROR_MARKER in error_str
+            and not any(marker in error_str for marker in self.UNRESOLVED_NAME_MARKERS)
+        )
+
+    def clear_parse_error_cache(self):
+        """Forgets cached parse errors, e.g. after plugins or modules were loaded on the server."""
+        with self._parse_error_lock:
+            self._parse_error_cache.clear()
+
     def run(self, script: str) -> ExecutionResult:
         """
         Executes a DolphinDB script and captures its output or error.
@@ -58,6 +211,21 @@ class CodeExecutor:
                 error_message="Error: Empty script provided."
             )
 
+        script_hash = hashlib.blake2b(script.encode('utf-8'), digest_size=16).hexdigest()
+        cached = None
+        with self._parse_error_lock:
+            entry = self._parse_error_cache.get(script_hash)
+            if entry is not None:
+                if time.monotonic() - entry[1] > self.PARSE_ERROR_CACHE_TTL:
+                    del self._parse_error_cache[script_hash]
+                else:
+                    cached = entry[0]
+                    self._parse_error_cache.move_to_end(script_hash)
+        if cached is not None:
+            if self.logger:
+                self.logger.info("Script failed to parse before; returning the cached error.")
+            return cached
+
         if self.logger:
             self.logger.info("Executing DolphinDB script...")
             # For security, you might want to log only a snippet of the script
@@ -66,9 +234,25 @@ class CodeExecutor:
         start_time = time.time()
         
         try:
-            # 使用 `with` 语句来自动管理 session 的连接和关闭
-            with DatabaseSession(self.host, self.port, self.user, self.password, logger=self.logger) as db_session:
+            # 从连接池中借用一个 session，用完归还，避免每次执行都重新建立连接
+            db_session = self._acquire_session()
+            try:
                 success, result = db_session.execute(script)
+            except ConnectionError as e:
+                # 池中的连接可能已被服务端断开：丢弃它，在一个全新的连接上重试一次。
+                # 不从连接池中取：失败的那次执行可能已经部分完成，重试不能依赖任何已有会话的状态
+                if self.logger:
+                    self.logger.warning(f"DolphinDB connection lost ({e}), reconnecting and retrying once.")
+                db_session = self._reopen_session(db_session)
+                try:
+                    success, result = db_session.execute(script)
+                except BaseException:
+                    self._discard_session(db_session)
+                    raise
+            except BaseException:
+                self._discard_session(db_session)
+                raise
+            self._release_session(db_session, reusable=not _USE_MODULE_RE.search(script))
             
             end_time = time.time()
             duration = end_time - start_time
@@ -76,6 +260,8 @@ class CodeExecutor:
             if success:
                 if self.logger:
                     self.logger.info(f"Script executed successfully in {duration:.2f} seconds.")
+                if _SERVER_STATE_CHANGE_RE.search(script):
+                    self.clear_parse_error_cache()
                 return ExecutionResult(
                     success=True,
                     data=result,
@@ -87,12 +273,18 @@ class CodeExecutor:
                 error_str = str(result)
                 if self.logger:
                     self.logger.warning(f"Script execution failed after {duration:.2f} seconds. Error: {error_str}")
-                return ExecutionResult(
+                failed_result = ExecutionResult(
                     success=False,
                     error_message=error_str,
                     executed_script=script,
                     metadata={"execution_duration_seconds": duration}
                 )
+                if self._is_pure_parse_error(error_str):
+                    with self._parse_error_lock:
+                        self._parse_error_cache[script_hash] = (failed_result, time.monotonic())
+                        if len(self._parse_error_cache) > self.PARSE_ERROR_CACHE_SIZE:
+                            self._parse_error_cache.popitem(last=False)
+                return failed_result
 
         except Exception as e:
             # 这是一个兜底的异常捕获，以防 DatabaseSession 本身出现问题（比如连接失败）
@@ -106,4 +298,32 @@ class CodeExecutor:
                 error_message=error_msg,
                 executed_script=script,
                 metadata={"execution_duration_seconds": duration}
-            )
\ No newline at end of file
+            )
+
+    def run_batch(self, expressions: List[str]) -> List[ExecutionResult]:
+        """
+        Evaluates several DolphinDB expressions in one round-trip, as the tuple
+        `[expr1, expr2, ...]`, and returns one ExecutionResult per expression.
+
+        Only single expressions (not multi-statement scripts) can be batched this
+        way. If the combined script fails, e.g. because one of the expressions is
+        invalid, each expression is run on its own so that every result carries
+        its own error.
+        """
+        if len(expressions) < 2:
+            return [self.run(expression) for expression in expressions]
+
+        combined = self.run(f"[{', '.join(expressions)}]")
+        data = combined.data
+        if combined.success and data is not None and len(data) == len(expressions):
+            duration = (combined.metadata or {}).get("execution_duration_seconds")
+            return [
+                ExecutionResult(
+                    success=True,
+                    data=value,
+                    executed_script=expression,
+                    metadata={"execution_duration_seconds": duration, "batched": True}
+                )
+                for expression, value in zip(expressions, data)
+            ]
+        return [self.run(expression) for expression in expressions]
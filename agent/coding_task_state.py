@@ -1,11 +1,14 @@
 # file: agent/coding_task_state.py
 
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from collections import deque
+from dataclasses import dataclass, field
+from typing import ClassVar, Deque, Optional
 
 from agent.execution_result import ExecutionResult
 
-class CodingTaskState(BaseModel):
+# 这是一个在修正循环中被频繁修改的内部状态对象，不需要校验，用带 slots 的 dataclass 即可
+@dataclass(slots=True)
+class CodingTaskState:
     """
     Manages the state of a single, iterative coding task.
     This object is passed through the execution loop.
@@ -13,24 +16,36 @@ class CodingTaskState(BaseModel):
     original_query: str
     current_code: str = ""
     
-    # 记录每次执行的结果，形成调试历史
-    execution_history: List[ExecutionResult] = Field(default_factory=list)
+    # 只保留最近几次执行的结果，避免长时间调试时 (可能很大的) 结果数据无限累积
+    execution_history: Deque[ExecutionResult] = field(default_factory=lambda: deque(maxlen=CodingTaskState.HISTORY_SIZE))
+    # 每次失败的简短摘要 (截断后的错误信息)，作为修正时的历史参考
+    error_summary: str = ""
     
     # 用于RAG的上下文，可以在循环中更新
     rag_context: str = ""
+    # rag_context 的 token 数，构建时计算一次，避免每轮修正重复计数
+    rag_context_tokens: int = 0
     
     # 控制循环次数
     refinement_attempts: int = 0
     max_attempts: int = 5
 
+    HISTORY_SIZE: ClassVar[int] = 3
+    ERROR_SUMMARY_CHARS: ClassVar[int] = 200
+
     @property
     def has_reached_max_attempts(self) -> bool:
         """Check if the task has run out of refinement attempts."""
         return self.refinement_attempts >= self.max_attempts
     
     def add_execution_result(self, result: ExecutionResult):
-        """Adds a new execution result to the history."""
+        """Adds a new execution result to the history and records failures in the error summary."""
         self.execution_history.append(result)
+        if not result.success:
+            error = (result.error_message or "").strip().replace("\n", " ")
+            if len(error) > self.ERROR_SUMMARY_CHARS:
+                error = error[:self.ERROR_SUMMARY_CHARS] + "..."
+            self.error_summary += f"- Attempt {self.refinement_attempts + 1}: {error}\n"
 
     def get_last_error(self) -> Optional[str]:
         """Convenience method to get the last error message, if any."""
@@ -0,0 +1,33 @@
+# file: agent/plan_cache.py
+
+import os
+from typing import Optional
+
+from utils.sqlite_cache import SQLiteCache
+
+
+class PlanCache(SQLiteCache):
+    """
+    A persistent cache for generated plans and scripts, keyed by a fingerprint
+    (a hash of everything the generation depended on).
+
+    Entries are stored in a SQLite table, expire after a TTL and are evicted in
+    LRU order once the stored plans exceed `max_bytes`. The cache can be turned
+    off with DDB_PLAN_CACHE=0; TTL and size limit are configurable through
+    DDB_PLAN_CACHE_TTL (seconds) and DDB_PLAN_CACHE_MAX_BYTES.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ddb_agent", "plan_cache.sqlite3")
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        enabled: Optional[bool] = None
+    ):
+        super().__init__(
+            path=path or self.DEFAULT_PATH,
+            ttl_seconds=ttl_seconds if ttl_seconds is not None else float(os.getenv("DDB_PLAN_CACHE_TTL", str(self.DEFAULT_TTL_SECONDS))),
+            max_bytes=max_bytes if max_bytes is not None else int(os.getenv("DDB_PLAN_CACHE_MAX_BYTES", str(self.DEFAULT_MAX_BYTES))),
+            enabled=enabled if enabled is not None else os.getenv("DDB_PLAN_CACHE", "1") != "0"
+        )
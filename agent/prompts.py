@@ -5,11 +5,44 @@ from llm.llm_prompt import llm
 
 # 这个文件将存放所有与 Coding Agent 任务相关的 prompts
 
+# 通用聊天 prompt：所有上下文都已在 conversation_history 中，模板只用于触发调用
+# 定义在模块级别，装饰器 (模板预编译等) 只在导入时执行一次
+@llm.prompt()
+def chat_prompt(conversation_history: List[Dict[str, str]]):
+    """
+    You are a helpful DolphinDB assistant. Continue the conversation naturally.
+    The user's latest message is the last one in the history.
+    """
+
+
+@llm.prompt(stream=True)
+def streaming_chat_prompt(conversation_history: List[Dict[str, str]]):
+    """
+    You are a helpful DolphinDB assistant. Continue the conversation naturally.
+    The user's latest message is the last one in the history.
+    """
+
+
+# 与 streaming_chat_prompt 相同，但返回异步生成器，供 asyncio 调用方使用
+@llm.prompt(stream=True, use_async=True)
+def async_streaming_chat_prompt(conversation_history: List[Dict[str, str]]):
+    """
+    You are a helpful DolphinDB assistant. Continue the conversation naturally.
+    The user's latest message is the last one in the history.
+    """
+
+
 @llm.prompt(model="deepseek-reasoner") # 我们可以为代码任务指定一个更擅长编码的模型
 def generate_initial_script(user_query: str, rag_context: str) -> str:
     """
     You are a world-class DolphinDB expert developer. Your task is to write a DolphinDB script to solve the user's request.
 
+    ## Your Task
+    - Write a complete, executable DolphinDB script that directly addresses the user's request.
+    - **Do not** add any explanations, comments, or markdown formatting around the code.
+    - Your output must be **only the raw script code**.
+    - ensure the output not wrappered in any code block or markdown formatting.
+    <|user|>
     ## User Request
     {{ user_query }}
 
@@ -18,12 +51,6 @@ def generate_initial_script(user_query: str, rag_context: str) -> str:
     <CONTEXT>
     {{ rag_context }}
     </CONTEXT>
-
-    ## Your Task
-    - Write a complete, executable DolphinDB script that directly addresses the user's request.
-    - **Do not** add any explanations, comments, or markdown formatting around the code.
-    - Your output must be **only the raw script code**.
-    - ensure the output not wrappered in any code block or markdown formatting.
     """
     pass
 
@@ -34,12 +61,18 @@ def fix_script_from_error(
     failed_code: str,
     error_message: str,
     rag_context: str,
-    # (可选) 增加一个 full_history 字段，提供完整的尝试历史
-    # full_history: str 
+    # 之前各次失败的简短摘要，而不是完整的执行历史
+    error_summary: str = ""
 ) -> str:
     """
     You are an elite DolphinDB debugging expert. You previously wrote a script that failed to execute. Your task is to analyze the error and provide a corrected version of the script.
 
+    ## Your Task
+    1.  Carefully analyze the error message in the context of the code and the original request.
+    2.  Identify the root cause of the error.
+    3.  Provide a new, complete, and corrected version of the script.
+    4.  **Do not** add any explanations or markdown. Your output must be **only the raw, fixed script code**.
+    <|user|>
     ## Original User Request
     {{ original_query }}
 
@@ -59,16 +92,17 @@ def fix_script_from_error(
     ```
     {{ error_message }}
     ```
-
-    ## Your Task
-    1.  Carefully analyze the error message in the context of the code and the original request.
-    2.  Identify the root cause of the error.
-    3.  Provide a new, complete, and corrected version of the script.
-    4.  **Do not** add any explanations or markdown. Your output must be **only the raw, fixed script code**.
+    {% if error_summary %}
+    ## Errors From All Attempts So Far
+    {{ error_summary }}
+    {% endif %}
     """
     pass
 
-@llm.prompt(model="deepseek") # Planner需要最强的模型
+# 调试计划使用 JSON 输出模式：由服务端保证输出是合法的 JSON 对象 (该模式要求顶层为对象，计划放在 "plan" 字段中)
+DEBUG_PLAN_RESPONSE_FORMAT = {"type": "json_object"}
+
+@llm.prompt(model="deepseek", response_format=DEBUG_PLAN_RESPONSE_FORMAT) # Planner需要最强的模型
 def debugging_planner(
     original_query: str,
     failed_code: str,
@@ -80,33 +114,19 @@ def debugging_planner(
     You are an autonomous debugging expert for DolphinDB.
     A script you wrote has failed. Your goal is to create a step-by-step plan to identify the cause of the error and fix the script.
 
-    ## Initial Goal
-    The user wants to: {{ original_query }}
-
-    ## The Code that Failed
-    ```dolphiindb
-    {{ failed_code }}
-    ```
-
-    ## The Error Message
-    ```
-    {{ error_message }}
-    ```
-
     ## Available Tools
     You have access to the following tools to help you diagnose the problem.
     {{ tool_definitions }}
 
     ## Your Task
-    Based on the error, create a JSON plan of actions to take.
+    Based on the error, create a plan of actions to take, as a JSON object with the steps in a "plan" array.
     - Think step-by-step.
     - The plan should lead to a final, corrected script.
     - The available actions are the names of the tools provided.
     - The final step in your plan should ALWAYS be `run_dolphindb_script` with the fully corrected code.
 
-    Example Plan for a function error:
-    ```json
-    [
+    Example output for a function error:
+    {"plan": [
       {
         "step": 1,
         "thought": "The error message 'wavg function needs 2 argument(s)' suggests I used the wavg function incorrectly. I need to check its correct signature and documentation.",
@@ -119,7 +139,25 @@ def debugging_planner(
         "action": "run_dolphindb_script",
         "args": {"script": "trades = stocks::create_mock_trades_table()\nselect wavg(price, qty) from trades"}
       }
-    ]
+    ]}
+    <|user|>
+    ## Initial Goal
+    The user wants to: {{ original_query }}
+
+    ## The Code that Failed
+    ```dolphiindb
+    {{ failed_code }}
+    ```
+
+    ## The Error Message
+    ```
+    {{ error_message }}
     ```
     """
-    pass
\ No newline at end of file
+    pass
+
+
+# 与 debugging_planner 使用相同的模板，但流式返回：计划的各个步骤可以在生成过程中逐个解析
+streaming_debugging_planner = llm.prompt(
+    model="deepseek", stream=True, response_format=DEBUG_PLAN_RESPONSE_FORMAT
+)(debugging_planner.__wrapped__)
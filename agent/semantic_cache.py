@@ -0,0 +1,120 @@
+# file: agent/semantic_cache.py
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Sequence, Tuple
+
+from utils.tokenizer import tokenize_sequence
+
+
+class SemanticCache:
+    """
+    A small in-memory cache that returns a previously stored value when a new
+    query is semantically close to one seen before.
+
+    Queries are embedded as sets of words and word bigrams (via `tokenize_sequence`),
+    packed into fixed-width bitsets, and compared with cosine similarity. A hit
+    additionally requires the shared words to appear in the same order, so that
+    permutations such as "copy trades into quotes" / "copy quotes into trades" never
+    match. Entries are namespaced (e.g. by task type) and keyed by an optional
+    `context` string (e.g. a fingerprint of the preceding conversation) that must
+    match exactly. They expire after a TTL and are evicted in LRU order once
+    `max_size` is reached. Threshold, size and TTL can be configured through the
+    environment variables DDB_SEMANTIC_CACHE_THRESHOLD, DDB_SEMANTIC_CACHE_SIZE and
+    DDB_SEMANTIC_CACHE_TTL.
+    """
+    # 向量位宽：词通过哈希映射到位上，偶尔的冲突只会略微抬高相似度
+    VECTOR_BITS = 4096
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_size: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.threshold = threshold if threshold is not None else float(os.getenv("DDB_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("DDB_SEMANTIC_CACHE_SIZE", "256"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("DDB_SEMANTIC_CACHE_TTL", "3600"))
+
+        # (namespace, context, query) -> (query_vector, vector_size, tokens, value, created_at)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[int, int, Tuple[str, ...], Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _embed(self, tokens: Sequence[str]) -> int:
+        """
+        Packs the query's words and word bigrams into an int bitset; intersections
+        become `&` plus `bit_count()`. Bigrams make the similarity sensitive to word order.
+        """
+        vector = 0
+        for token in tokens:
+            vector |= 1 << (hash(token) % self.VECTOR_BITS)
+        for first, second in zip(tokens, tokens[1:]):
+            vector |= 1 << (hash((first, second)) % self.VECTOR_BITS)
+        return vector
+
+    @staticmethod
+    def _same_word_order(tokens: Sequence[str], other: Sequence[str]) -> bool:
+        """True if the words the two queries share appear in the same order in both."""
+        shared = set(tokens) & set(other)
+        return [t for t in tokens if t in shared] == [t for t in other if t in shared]
+
+    def lookup(self, query: str, namespace: str = "default", context: str = "") -> Optional[Any]:
+        """
+        Returns the cached value of the most similar query in `namespace` that was
+        stored with the same `context`, or None if nothing reaches the similarity threshold.
+        """
+        tokens = tuple(tokenize_sequence(query))
+        query_vector = self._embed(tokens)
+        if not query_vector:
+            return None
+
+        query_size = query_vector.bit_count()
+        # 二值向量的余弦相似度不超过 sqrt(较小长度 / 较大长度)：
+        # 长度相差过大的条目不可能达到阈值，无需计算交集
+        min_size_ratio = self.threshold * self.threshold
+
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, 0.0
+            expired = []
+            for key, (cached_vector, cached_size, cached_tokens, _, created_at) in self._entries.items():
+                if now - created_at > self.ttl_seconds:
+                    expired.append(key)
+                    continue
+                if key[0] != namespace or key[1] != context:
+                    continue
+                if min(query_size, cached_size) < min_size_ratio * max(query_size, cached_size):
+                    continue
+                score = (query_vector & cached_vector).bit_count() / math.sqrt(query_size * cached_size)
+                if score > best_score and score >= self.threshold and self._same_word_order(tokens, cached_tokens):
+                    best_key, best_score = key, score
+            for key in expired:
+                del self._entries[key]
+
+            if best_key is None:
+                return None
+
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][3]
+
+    def put(self, query: str, value: Any, namespace: str = "default", context: str = ""):
+        """Stores `value` for `query` under `context`, evicting the least recently used entries if needed."""
+        tokens = tuple(tokenize_sequence(query))
+        query_vector = self._embed(tokens)
+        if not query_vector:
+            return
+
+        key = (namespace, context, query)
+        with self._lock:
+            self._entries[key] = (query_vector, query_vector.bit_count(), tokens, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops all cached entries."""
+        with self._lock:
+            self._entries.clear()
@@ -1,23 +1,128 @@
 # file: agent/tool_manager.py (新建)
 
-from agent.tools.tool_interface import BaseTool
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Generator, Optional
+
+from agent.execution_result import ExecutionResult
+from agent.tools.tool_interface import BaseTool, Observation, ToolResult
+from utils.json_parser import dumps_json
 
 
 class ToolManager:
+    # call_tool_streaming 在工具运行期间输出进度的间隔 (秒)
+    PROGRESS_INTERVAL = 1.0
+
     def __init__(self, tools: list[BaseTool]):
         self.tools = {tool.name: tool for tool in tools}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ddb-tool')
+        # 工具定义 (及其序列化结果)，工具集合变化时失效
+        self._tool_defs: Optional[list[dict]] = None
+        self._tool_defs_cache: Optional[str] = None
+        self._tool_defs_digest: Optional[str] = None
+        # 工具集合在构造后通常不再变化：此时就生成定义，首次规划不再承担 schema 生成的开销
+        self.get_tool_definitions_json()
+
+    def register_tool(self, tool: BaseTool):
+        """Adds (or replaces) a tool."""
+        self.tools[tool.name] = tool
+        self._tool_defs = None
+        self._tool_defs_cache = None
+        self._tool_defs_digest = None
 
     def get_tool_definitions(self) -> list[dict]:
         """Returns a list of all tool definitions for the Planner."""
-        return [tool.get_definition() for tool in self.tools.values()]
+        # 生成 JSON schema 的开销不小，工具不变时只生成一次
+        if self._tool_defs is None:
+            self._tool_defs = [tool.get_definition() for tool in self.tools.values()]
+        return self._tool_defs
+
+    @property
+    def definitions_json(self) -> str:
+        """The cached JSON string of all tool definitions (see `get_tool_definitions_json`)."""
+        return self.get_tool_definitions_json()
+
+    def get_tool_definitions_json(self) -> str:
+        """
+        Returns the tool definitions as an indented JSON string for prompts. The string
+        is serialized once (with sorted keys, so it is byte-stable) and reused until
+        the set of tools changes.
+        """
+        if self._tool_defs_cache is None:
+            self._tool_defs_cache = dumps_json(self.get_tool_definitions(), indent=True, sort_keys=True)
+        return self._tool_defs_cache
+
+    @property
+    def definitions_digest(self) -> str:
+        """A short hash of `definitions_json`, for cache keys that depend on the tool set."""
+        if self._tool_defs_digest is None:
+            self._tool_defs_digest = hashlib.blake2b(
+                self.get_tool_definitions_json().encode('utf-8'), digest_size=16
+            ).hexdigest()
+        return self._tool_defs_digest
 
-    def call_tool(self, tool_name: str, args: dict) -> str:
-        if tool_name not in self.tools:
-            return f"Error: Tool '{tool_name}' not found."
-        tool = self.tools[tool_name]
+    def is_parallel_safe(self, tool_name: str) -> bool:
+        tool = self.tools.get(tool_name)
+        return tool is not None and tool.parallel_safe
+
+    def call_tool(self, tool_name: str, args: dict) -> ToolResult:
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            error = f"Tool '{tool_name}' not found."
+            return ToolResult(success=False, output=f"Error: {error}", error=error)
         try:
             # Pydantic v2 用 model_validate
             validated_args = tool.args_schema.model_validate(args)
-            return tool.run(validated_args)
+            result = tool.run(validated_args)
         except Exception as e:
-            return f"Error validating arguments for tool '{tool_name}': {e}"
\ No newline at end of file
+            error = f"Error validating arguments for tool '{tool_name}': {e}"
+            return ToolResult(success=False, output=error, error=error)
+        return self._to_tool_result(result)
+
+    def call_tool_batch(self, tool_name: str, args_list: list[dict]) -> list[ToolResult]:
+        """
+        Calls the same tool with several argument sets, letting the tool serve them
+        together (e.g. in one DolphinDB round-trip) when it supports it.
+        Returns one ToolResult per argument set, in order.
+        """
+        tool = self.tools.get(tool_name)
+        if tool is None or len(args_list) < 2:
+            return [self.call_tool(tool_name, args) for args in args_list]
+        try:
+            validated_args = [tool.args_schema.model_validate(args) for args in args_list]
+            results = tool.run_batch(validated_args)
+        except Exception:
+            # 批量执行失败时逐个调用，每个调用得到各自的错误信息
+            return [self.call_tool(tool_name, args) for args in args_list]
+        return [self._to_tool_result(result) for result in results]
+
+    @staticmethod
+    def _to_tool_result(result) -> ToolResult:
+        if isinstance(result, ExecutionResult):
+            return ToolResult(
+                success=result.success,
+                output=Observation(result.data) if result.success else "",
+                error=result.error_message,
+                raw=result
+            )
+        # 其他工具 (如 get_function_signature) 直接返回字符串
+        return ToolResult(success=True, output=str(result), raw=result)
+
+    def call_tool_streaming(self, tool_name: str, args: dict) -> Generator[str, None, ToolResult]:
+        """
+        Like `call_tool`, but runs the tool in the background and yields progress
+        messages while it is still running. The final `ToolResult` is the
+        generator's return value (use `yield from` or catch `StopIteration`).
+        """
+        future = self._executor.submit(self.call_tool, tool_name, args)
+        start = time.monotonic()
+        while True:
+            try:
+                return future.result(timeout=self.PROGRESS_INTERVAL)
+            except FutureTimeoutError:
+                yield f"'{tool_name}' still running ({time.monotonic() - start:.0f}s elapsed)..."
+
+    def close(self):
+        """Stops the background worker used by `call_tool_streaming`."""
+        self._executor.shutdown(wait=False)
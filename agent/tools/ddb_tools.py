@@ -1,10 +1,14 @@
-import dolphindb as ddb
+import re
+
 from pydantic import Field
 
 from agent.execution_result import ExecutionResult 
 from .tool_interface import BaseTool, ToolInput
 from agent.code_executor import CodeExecutor 
 
+# 可以安全拼接进脚本的函数名 (可带模块前缀，如 stocks::foo)
+_FUNCTION_NAME_RE = re.compile(r'^[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*$')
+
 class GetFunctionSignatureInput(ToolInput):
     function_name: str = Field(description="The name of the DolphinDB function to look up.")
 
@@ -12,19 +16,35 @@ class GetFunctionSignatureTool(BaseTool):
     name = "get_function_signature"
     description = "Retrieves the definition and documentation of a specific DolphinDB function. Use this when you encounter an error related to a function call, like wrong number of arguments or unknown function."
     args_schema = GetFunctionSignatureInput
-    
-    # 我们需要一个DDB session来执行'help'命令
-    # 这里的实现是简化的，实际中可能需要从CodeExecutor传入session
-    _session = ddb.session() 
-    # _session.connect(...)
+    parallel_safe = True
+
+    def __init__(self, executor: CodeExecutor | None = None):
+        # 通过 CodeExecutor 的连接池执行 'help' 命令，多个查询可以安全地并发进行
+        self.executor = executor or CodeExecutor()
 
     def run(self, args: GetFunctionSignatureInput) -> str:
-        try:
-            # DolphinDB的 `help` 函数可以获取函数定义
-            result = self._session.run(f"help({args.function_name})")
-            return str(result)
-        except Exception as e:
-            return f"Error: Could not retrieve help for function '{args.function_name}'. Reason: {e}"
+        # 函数名会被直接拼进脚本：不是合法标识符的输入不发给服务器，避免注入任意脚本
+        if not _FUNCTION_NAME_RE.match(args.function_name):
+            return f"Error: Could not retrieve help for function '{args.function_name}'. Reason: not a valid function name."
+        # DolphinDB的 `help` 函数可以获取函数定义
+        result = self.executor.run(f"help({args.function_name})")
+        if result.success:
+            return str(result.data)
+        return f"Error: Could not retrieve help for function '{args.function_name}'. Reason: {result.error_message}"
+
+    def run_batch(self, args_list: list[GetFunctionSignatureInput]) -> list[str]:
+        """Looks up several functions with a single `[help(f1), help(f2), ...]` script."""
+        names = [args.function_name for args in args_list]
+        if len(names) < 2 or not all(_FUNCTION_NAME_RE.match(name) for name in names):
+            return super().run_batch(args_list)
+
+        # 一次往返执行 [help(f1), help(f2), ...]；任何一个函数名无效时 run_batch 会退回逐个执行
+        results = self.executor.run_batch([f"help({name})" for name in names])
+        return [
+            str(result.data) if result.success
+            else f"Error: Could not retrieve help for function '{name}'. Reason: {result.error_message}"
+            for name, result in zip(names, results)
+        ]
         
 class RunDolphinDBScriptInput(ToolInput):
     script: str = Field(description="The DolphinDB script to execute.")
@@ -34,8 +54,9 @@ class RunDolphinDBScriptTool(BaseTool):
     description = "Executes a given DolphinDB script. Returns the data output on success or an error message on failure."
     args_schema = RunDolphinDBScriptInput
     
-    def __init__(self):
-        self.executor = CodeExecutor()
+    def __init__(self, executor: CodeExecutor | None = None):
+        # 可以传入共享的 CodeExecutor，与 agent 复用同一个连接池
+        self.executor = executor or CodeExecutor()
 
     def run(self, args: RunDolphinDBScriptInput) -> ExecutionResult:
         return self.executor.run(args.script)
\ No newline at end of file
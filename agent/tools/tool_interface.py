@@ -1,24 +1,112 @@
 # file: agent/tools/tool_interface.py (新建)
 from abc import ABC, abstractmethod
-from pydantic import BaseModel, Field
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, ClassVar, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field
 
 class ToolInput(BaseModel):
-    pass
+    # 推迟构建校验器：只导入工具模块 (如建索引时) 不需要付出 schema 构建的开销，首次使用时再构建
+    model_config = ConfigDict(defer_build=True)
+
+class Observation:
+    """
+    A lazily formatted, size-capped text view of a tool's result data.
+
+    Large results (e.g. a DolphinDB table) are only rendered when the text is
+    actually needed, and only the head of them: at most MAX_ROWS table rows,
+    MAX_ITEMS list/dict items and `limit` characters in total.
+    """
+    LIMIT = 4000
+    MAX_ROWS = 50
+    MAX_ITEMS = 20
+    MAX_VALUE_CHARS = 200
+
+    __slots__ = ("data", "limit", "_text")
+
+    def __init__(self, data: Any, limit: int = LIMIT):
+        self.data = data
+        self.limit = limit
+        self._text: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self._format(self.data, self.limit)
+        return self._text
+
+    @classmethod
+    def _format(cls, data: Any, limit: int) -> str:
+        # DataFrame (DolphinDB 表的查询结果)：只渲染前几行
+        if hasattr(data, "head") and hasattr(data, "to_string"):
+            text = data.head(cls.MAX_ROWS).to_string()
+            if len(data) > cls.MAX_ROWS:
+                text += f"\n... ({len(data)} rows total)"
+        elif isinstance(data, (list, tuple)):
+            items = list(islice(data, cls.MAX_ITEMS))
+            text = repr(items)
+            if len(data) > cls.MAX_ITEMS:
+                text += f"\n... ({len(data)} items total)"
+        elif isinstance(data, dict):
+            text = "{" + ", ".join(
+                f"{k!r}: {repr(v)[:cls.MAX_VALUE_CHARS]}" for k, v in islice(data.items(), cls.MAX_ITEMS)
+            ) + "}"
+            if len(data) > cls.MAX_ITEMS:
+                text += f"\n... ({len(data)} keys total)"
+        else:
+            text = str(data)
+
+        if len(text) > limit:
+            text = text[:limit] + f"\n... (truncated, {len(text)} chars total)"
+        return text
+
+@dataclass
+class ToolResult:
+    """
+    The structured outcome of a tool call, so callers can branch on `success`
+    instead of scanning the rendered output.
+    """
+    success: bool
+    output: Union[str, Observation]
+    error: Optional[str] = None
+    # 工具返回的原始对象 (例如 ExecutionResult)，供需要完整结果的调用方使用
+    raw: Any = None
+
+    @property
+    def observation(self) -> Union[str, Observation]:
+        """What to show for this result; on success this may be a lazy `Observation`."""
+        return self.output if self.success else f"Execution failed. Error:\n{self.error}"
+
+    def __str__(self) -> str:
+        return str(self.observation)
 
 class BaseTool(ABC):
     name: str
     description: str
     args_schema: type[BaseModel]
+    # 只读、无副作用且线程安全的工具：计划中连续的此类步骤可以并发执行
+    parallel_safe: bool = False
+    # args_schema -> JSON schema；schema 类不可变，生成一次即可在所有实例间共享
+    _schema_cache: ClassVar[dict[type, dict]] = {}
 
     @abstractmethod
     def run(self, args: BaseModel) -> str:
         """Executes the tool and returns a string representation of the result."""
         pass
 
+    def run_batch(self, args_list: list[BaseModel]) -> list:
+        """
+        Executes the tool once per args. Tools that can serve several calls in a
+        single round-trip override this.
+        """
+        return [self.run(args) for args in args_list]
+
     def get_definition(self) -> dict:
         """Returns a JSON-serializable definition of the tool for the LLM."""
+        schema = BaseTool._schema_cache.get(self.args_schema)
+        if schema is None:
+            schema = BaseTool._schema_cache[self.args_schema] = self.args_schema.model_json_schema()
         return {
             "name": self.name,
             "description": self.description,
-            "parameters": self.args_schema.model_json_schema()
+            "parameters": schema
         }
\ No newline at end of file
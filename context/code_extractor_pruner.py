@@ -4,13 +4,16 @@ import json
 from typing import List, Dict, Any, Tuple
 from llm.llm_prompt import llm  # 假设您使用之前设计的llm.prompt
 from token_counter import count_tokens # 引入我们之前创建的token计数器
+from utils.json_parser import parse_json_string
+from utils.text_lines import line_starts, number_lines
 
 class Document:
     """A simple container for source code or md doc data."""
     def __init__(self, file_path: str, source_code: str, tokens: int = -1):
         self.file_path = file_path
         self.source_code = source_code
-        self.tokens = tokens if tokens != -1 else count_tokens(source_code)
+        # 未提供 (tokens < 0 或 None) 时才计数；count_tokens 按内容缓存
+        self.tokens = tokens if tokens is not None and tokens >= 0 else count_tokens(source_code)
 
 class CodeExtractorPruner:
     """
@@ -23,15 +26,20 @@ class CodeExtractorPruner:
         # 设置一个阈值，小于此阈值的文件将被完整保留，以提高效率
         self.full_file_threshold = int(max_tokens * 0.8)
 
-    @llm.prompt(response_model=List[Dict[str, int]])
-    def _extract_snippets_prompt(self, conversations: List[Dict[str, str]], content_with_lines: str) -> dict:
+    # 单次抽取请求中文件内容的 token 上限，超出时拆成多次请求 (单个超大文件独占一批)
+    EXTRACT_BATCH_TOKENS = 8000
+
+    @llm.prompt()
+    def _extract_snippets_prompt(self, conversations: List[Dict[str, str]], files: List[Dict[str, str]]) -> dict:
         """
-        Based on the provided code file and conversation history, extract relevant code snippets.
+        Based on the provided code files and conversation history, extract relevant code snippets.
 
-        The code file content is provided below with line numbers.
-        <CODE_FILE>
-        {{ content_with_lines }}
+        Each code file is provided below with its id and its content with line numbers.
+        {% for file in files %}
+        <CODE_FILE id="{{ file.id }}" path="{{ file.path }}">
+        {{ file.content_with_lines }}
         </CODE_FILE>
+        {% endfor %}
 
         Here is the conversation history leading to the current task.
         <CONVERSATION_HISTORY>
@@ -42,28 +50,31 @@ class CodeExtractorPruner:
 
         Your Task:
         1. Analyze the last user request in the conversation history.
-        2. Identify one or more important code sections in the code file that are relevant to this request.
+        2. For each code file, identify the important code sections that are relevant to this request.
         3. For each relevant section, determine its start and end line numbers.
-        4. You can return up to 4 snippets.
+        4. You can return up to 4 snippets per file.
 
         Output Requirements:
-        - Return a JSON array of objects, where each object contains "start_line" and "end_line".
+        - Return a JSON object that maps each file id to an array of objects, where each object contains "start_line" and "end_line".
         - Line numbers must be integers and correspond to the numbers in the provided code file.
-        - If no code sections are relevant, return an empty array [].
-        - Your response MUST be a valid JSON array and nothing else.
+        - If no code sections of a file are relevant, map its id to an empty array [].
+        - Your response MUST be a valid JSON object and nothing else.
 
         Example output:
         ```json
-        [
-            {"start_line": 10, "end_line": 25},
-            {"start_line": 88, "end_line": 95}
-        ]
+        {
+            "0": [
+                {"start_line": 10, "end_line": 25},
+                {"start_line": 88, "end_line": 95}
+            ],
+            "1": []
+        }
         ```
         """
         # 这个函数将使用 llm.prompt 装饰器，自动填充模板
         return {
             "model": self.llm_model_name,
-            # conversations 和 content_with_lines 会从函数参数中获取
+            # conversations 和 files 会从函数参数中获取
         }
     
     def _merge_overlapping_snippets(self, snippets: List[Dict[str, int]]) -> List[Dict[str, int]]:
@@ -71,29 +82,33 @@ class CodeExtractorPruner:
         if not snippets:
             return []
 
-        # 按起始行排序
-        sorted_snippets = sorted(snippets, key=lambda x: x["start_line"])
+        # 只对 (start, end) 整数对排序和合并，不修改传入的 dict，结果在最后一次性构造
+        intervals = sorted((s["start_line"], s["end_line"]) for s in snippets)
 
-        merged = [sorted_snippets[0]]
-        for current in sorted_snippets[1:]:
+        merged = [list(intervals[0])]
+        for start, end in intervals[1:]:
             last = merged[-1]
             # 如果当前区间的开始在前一个区间的结束行+1的范围内，则合并
-            if current["start_line"] <= last["end_line"] + 1:
-                last["end_line"] = max(last["end_line"], current["end_line"])
+            if start <= last[1] + 1:
+                if end > last[1]:
+                    last[1] = end
             else:
-                merged.append(current)
-        return merged
+                merged.append([start, end])
+        return [{"start_line": start, "end_line": end} for start, end in merged]
 
     def _build_snippet_content(self, original_code: str, snippets: List[Dict[str, int]]) -> str:
         """Constructs the final content string from the extracted snippets."""
-        lines = original_code.splitlines()
+        # 只记录到最后一个片段为止的行起始偏移，直接从原字符串切片，不拆分整个文件
+        starts = line_starts(original_code, max((s["end_line"] for s in snippets), default=0))
+        num_lines = len(starts) - 1
         content_parts = ["# Snippets from the original file:\n"]
         
         for snippet in snippets:
             start = max(0, snippet["start_line"] - 1)
-            end = min(len(lines), snippet["end_line"])
+            end = min(num_lines, snippet["end_line"])
             content_parts.append(f"\n# ... (lines {start + 1}-{end}) ...\n")
-            content_parts.extend(lines[start:end])
+            if start < end:
+                content_parts.append(original_code[starts[start]:starts[end] - 1])
         
         return "\n".join(content_parts)
 
@@ -105,6 +120,8 @@ class CodeExtractorPruner:
         selected_files: List[Document] = []
         total_tokens = 0
         
+        large_files: List[Document] = []
+
         for file_source in file_sources:
             if total_tokens + file_source.tokens <= self.full_file_threshold:
                 # 1. 完整保留小文件
@@ -117,50 +134,90 @@ class CodeExtractorPruner:
                 print("Token limit reached. Stopping further processing.")
                 break
 
-            # 2. 对大文件进行片段抽取
-            print(f"🔍 Processing large file for snippets: {file_source.file_path} ({file_source.tokens} tokens)")
-            
-            try:
-                # 为文件内容添加行号
-                lines_with_numbers = "\n".join(
-                    f"{i+1} {line}" for i, line in enumerate(file_source.source_code.splitlines())
-                )
-                
-                # 调用 LLM 抽取片段
-                # 注意：这里我们假设单个文件添加行号后不会超过模型窗口，
-                # 如果会，则需要引入 `_split_content_with_sliding_window` 逻辑
-                raw_snippets = self._extract_snippets_prompt(
-                    conversations=conversations,
-                    content_with_lines=lines_with_numbers
-                )
-                
-                if not raw_snippets:
-                    print(f"  - No relevant snippets found in {file_source.file_path}.")
-                    continue
-                
-                # 合并重叠片段
-                merged_snippets = self._merge_overlapping_snippets(raw_snippets)
-                
-                # 构建新内容并计算token
-                new_content = self._build_snippet_content(file_source.source_code, merged_snippets)
-                new_tokens = count_tokens(new_content, model_name=self.llm_model_name)
-                
-                if total_tokens + new_tokens <= self.max_tokens:
-                    selected_files.append(Document(
-                        file_path=file_source.file_path,
-                        source_code=new_content,
-                        tokens=new_tokens
-                    ))
-                    total_tokens += new_tokens
-                    print(f"  - Extracted snippets from {file_source.file_path}. "
-                          f"Original: {file_source.tokens} tokens -> New: {new_tokens} tokens.")
-                else:
-                    print(f"  - Snippets from {file_source.file_path} are too large to fit. Skipping.")
-                    break # 如果添加片段后超限，则停止处理后续文件
-
-            except Exception as e:
-                print(f"Error processing snippets for {file_source.file_path}: {e}")
-                continue # 出错则跳过此文件
+            large_files.append(file_source)
+
+        if not large_files or total_tokens >= self.max_tokens:
+            print(f"Pruning complete. Final context has {len(selected_files)} files with {total_tokens} tokens.")
+            return selected_files
+
+        # 2. 对大文件进行片段抽取：按 token 预算分批，每批一次 LLM 调用，而不是每个文件一次
+        batches = self._group_for_extraction(large_files)
+        print(f"🔍 Extracting snippets from {len(large_files)} large file(s) in {len(batches)} request(s)...")
+
+        # 3. 按原顺序逐个文件构建片段内容，并在预算内裁剪；预算用尽后不再发起后续批次的抽取
+        for batch in batches:
+            snippets_by_file = self._extract_batch(batch, conversations)
+            for i, file_source in enumerate(batch):
+                try:
+                    raw_snippets = snippets_by_file.get(str(i))
+                    if not raw_snippets:
+                        print(f"  - No relevant snippets found in {file_source.file_path}.")
+                        continue
+
+                    # 合并重叠片段
+                    merged_snippets = self._merge_overlapping_snippets(raw_snippets)
+
+                    # 构建新内容并计算token
+                    new_content = self._build_snippet_content(file_source.source_code, merged_snippets)
+                    new_tokens = count_tokens(new_content, model_name=self.llm_model_name)
+
+                    if total_tokens + new_tokens <= self.max_tokens:
+                        selected_files.append(Document(
+                            file_path=file_source.file_path,
+                            source_code=new_content,
+                            tokens=new_tokens
+                        ))
+                        total_tokens += new_tokens
+                        print(f"  - Extracted snippets from {file_source.file_path}. "
+                              f"Original: {file_source.tokens} tokens -> New: {new_tokens} tokens.")
+                    else:
+                        print(f"  - Snippets from {file_source.file_path} are too large to fit. Skipping.")
+                        # 如果添加片段后超限，则停止处理后续文件
+                        print(f"Pruning complete. Final context has {len(selected_files)} files with {total_tokens} tokens.")
+                        return selected_files
+
+                except Exception as e:
+                    print(f"Error processing snippets for {file_source.file_path}: {e}")
+                    continue # 出错则跳过此文件
 
         print(f"Pruning complete. Final context has {len(selected_files)} files with {total_tokens} tokens.")
-        return selected_files
\ No newline at end of file
+        return selected_files
+
+    def _group_for_extraction(self, files: List[Document]) -> List[List[Document]]:
+        """
+        Groups consecutive files into batches of at most EXTRACT_BATCH_TOKENS tokens;
+        larger files get a batch of their own. The file order is preserved.
+        """
+        batches: List[List[Document]] = []
+        current: List[Document] = []
+        current_tokens = 0
+        for source in files:
+            if current and current_tokens + source.tokens > self.EXTRACT_BATCH_TOKENS:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(source)
+            current_tokens += source.tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _extract_batch(self, batch: List[Document], conversations: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Runs one extraction request for a batch; returns a map from the file's index in the batch (as str) to its snippets."""
+        files = [
+            {
+                "id": str(i),
+                "path": file_source.file_path,
+                # 为文件内容添加行号
+                "content_with_lines": number_lines(file_source.source_code),
+            }
+            for i, file_source in enumerate(batch)
+        ]
+        try:
+            response = self._extract_snippets_prompt(conversations=conversations, files=files)
+            snippets_by_file = parse_json_string(response) if isinstance(response, str) else response
+            if not isinstance(snippets_by_file, dict):
+                raise ValueError(f"expected a JSON object, got {type(snippets_by_file).__name__}")
+            return snippets_by_file
+        except Exception as e:
+            print(f"Error extracting snippets: {e}")
+            return {}
@@ -1,10 +1,12 @@
 # file: ddb_agent/context/context_builder.py (重构后)
 
+from bisect import bisect_right
+from itertools import accumulate
 from typing import List, Dict, Any, Literal
 
 from .pruner import get_pruner, Document
 from .budget import ContextBudget
-from token_counter import count_tokens
+from token_counter import count_tokens, count_tokens_batch, get_tokenizer
 
 class ContextBuilder:
     """
@@ -15,6 +17,36 @@ class ContextBuilder:
         self.model_name = model_name
         self.max_window_size = max_window_size
         self.safe_zone = int(max_window_size * 0.9)
+        # 在构造时预先加载 (并缓存) tokenizer，避免首个请求承担加载开销
+        get_tokenizer(model_name)
+
+    # 分层剪枝：按整体上下文占模型窗口的比例选择文件剪枝策略
+    FULL_CONTEXT_RATIO = 0.3     # 低于此比例：完整保留文件，不做任何剪枝
+    EXTRACT_CONTEXT_RATIO = 0.7  # 低于此比例：用 LLM 抽取相关片段；否则直接丢弃排名靠后的文件
+
+    def select_file_pruning_strategy(
+        self,
+        system_prompt: str,
+        conversations: List[Dict[str, Any]],
+        file_sources: List[Document]
+    ) -> str:
+        """
+        Chooses a file pruning strategy (a strategy name for `get_pruner`) from the
+        total size of the raw context.
+        """
+        # 一次批量计数；结果进入 token 缓存，随后 build 剪枝历史时直接命中
+        total_tokens = (
+            sum(count_tokens_batch(
+                [system_prompt, *(msg.get('content', '') for msg in conversations)], self.model_name
+            ))
+            + sum(max(f.tokens, 0) for f in file_sources)
+        )
+
+        if total_tokens < self.max_window_size * self.FULL_CONTEXT_RATIO:
+            return 'none'
+        if total_tokens < self.max_window_size * self.EXTRACT_CONTEXT_RATIO:
+            return 'extract'
+        return 'delete'
 
     def build(
         self,
@@ -22,9 +54,20 @@ class ContextBuilder:
         conversations: List[Dict[str, Any]],
         file_sources: List[Document],
         task_type: Literal['default', 'coding', 'chat'] = 'default',
-        file_pruning_strategy: str = 'extract'
+        file_pruning_strategy: str = 'extract',
+        cache_breakpoint: bool = False
     ) -> List[Dict[str, Any]]:
-        
+        """
+        Builds the final message list: [system, *earlier history, current user turn].
+
+        Retrieved files change from turn to turn, so they are attached to the current
+        user turn instead of being placed before the history; the system prompt and
+        the earlier turns then form a prefix that is identical to the previous request
+        and can be served from the provider's prompt cache. With `cache_breakpoint`,
+        the last message of that stable prefix is marked with an explicit
+        `cache_control` marker (for providers that require one, e.g. Anthropic).
+        """
+
         # 1. 首先计算不可动摇的 system_prompt 的 token 数
         system_prompt_tokens = count_tokens(system_prompt, self.model_name)
 
@@ -41,30 +84,74 @@ class ContextBuilder:
             # 我们可以选择返回一个只包含截断后的系统提示的最小化上下文
             return [{"role": "system", "content": self._prune_system_prompt(system_prompt, self.safe_zone)}]
 
-        # 3. 剪枝对话历史 (使用分配好的预算)
-        pruned_conversations = self._prune_conversation_history(conversations, budget.history_budget)
+        # 3. 拆出本轮的用户消息 (总是保留)，其余历史对话在剩余的历史预算内剪枝
+        current_turn = None
+        earlier_history = conversations
+        if conversations and conversations[-1].get('role') == 'user':
+            current_turn = conversations[-1]
+            earlier_history = conversations[:-1]
+        current_turn_tokens = count_tokens(current_turn.get('content', ''), self.model_name) if current_turn else 0
+        final_messages = self.build_prefix(
+            system_prompt, earlier_history, max(budget.history_budget - current_turn_tokens, 0)
+        )
         
         # 4. 剪枝文件上下文 (使用分配好的预算)
-        file_pruner = get_pruner(
-            strategy=file_pruning_strategy, 
-            max_tokens=budget.file_context_budget,
-            llm_model_name=self.model_name
-        )
-        pruned_file_sources = file_pruner.prune(file_sources, conversations)
+        #    文件总量已在预算内时无需剪枝，跳过剪枝器 (及其可能的 LLM 抽取调用)
+        if sum(f.tokens for f in file_sources) <= budget.file_context_budget:
+            pruned_file_sources = list(file_sources)
+        else:
+            file_pruner = get_pruner(
+                strategy=file_pruning_strategy, 
+                max_tokens=budget.file_context_budget,
+                llm_model_name=self.model_name
+            )
+            pruned_file_sources = file_pruner.prune(file_sources, conversations)
 
         # 5. 组合最终上下文
-        final_messages = [{"role": "system", "content": system_prompt}]
-        
+        # 顺序为 [system, 历史对话, 本轮用户消息 (附带文件上下文)]：
+        # 每轮都会变化的检索结果放在最后，system 和历史对话构成与上一轮请求相同的前缀，可命中前缀缓存
+        if cache_breakpoint:
+            final_messages[-1] = {**final_messages[-1], "cache_control": {"type": "ephemeral"}}
+
         if pruned_file_sources:
+            # 按文件路径稳定排序，并标注检索时的原始相关性排名 (剪枝器可能丢弃或替换文件，按路径回查)：
+            # 相同的检索结果集总是产生相同的 token 序列，便于服务端复用 KV 缓存
+            original_rank = {}
+            for rank, f in enumerate(file_sources, 1):
+                original_rank.setdefault(f.file_path, rank)
+            ranked_sources = sorted(
+                ((original_rank.get(f.file_path, len(file_sources) + 1), f) for f in pruned_file_sources),
+                key=lambda x: x[1].file_path
+            )
             file_context_str = "\n---\n".join(
-                f"File: {f.file_path}\n\n{f.source_code}" for f in pruned_file_sources
+                f"File: {f.file_path} (rank {rank})\n\n{f.source_code}" for rank, f in ranked_sources
             )
-            final_messages.append({"role": "assistant", "content": f"<CONTEXT_FILES>\n{file_context_str}\n</CONTEXT_FILES>"})
-           
-        final_messages.extend(pruned_conversations)
+            context_block = f"<CONTEXT_FILES>\n{file_context_str}\n</CONTEXT_FILES>"
+            # 合并进本轮的用户消息，避免出现连续两条 user 消息 (部分模型不接受)
+            if current_turn is not None:
+                current_turn = {**current_turn, "content": f"{context_block}\n\n{current_turn.get('content', '')}"}
+            else:
+                current_turn = {"role": "user", "content": context_block}
+
+        if current_turn is not None:
+            final_messages.append(current_turn)
 
         return final_messages
 
+    def build_prefix(
+        self,
+        system_prompt: str,
+        earlier_history: List[Dict[str, Any]],
+        history_budget: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns [system, *pruned earlier history], i.e. everything before the current
+        turn.
+        """
+        prefix = [{"role": "system", "content": system_prompt}]
+        prefix.extend(self._prune_conversation_history(earlier_history, history_budget))
+        return prefix
+
     def _prune_system_prompt(self, prompt: str, budget: int) -> str:
         # 这个方法现在主要用于极端情况下的报错和截断
         if count_tokens(prompt, self.model_name) > budget:
@@ -77,16 +164,9 @@ class ContextBuilder:
 
     def _prune_conversation_history(self, conversations: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
         """Prunes conversation history using a sliding window approach."""
-        pruned_history = []
-        current_tokens = 0
-        
-        # 从最新（末尾）的对话开始保留
-        for msg in reversed(conversations):
-            msg_tokens = count_tokens(msg.get('content', ''), self.model_name)
-            if current_tokens + msg_tokens <= budget:
-                pruned_history.insert(0, msg)
-                current_tokens += msg_tokens
-            else:
-                break
-        
-        return pruned_history
\ No newline at end of file
+        # 一次批量计数，再对从最新（末尾）开始的累计 token 数二分查找截断位置
+        msg_tokens = count_tokens_batch(
+            [msg.get('content', '') for msg in reversed(conversations)], self.model_name
+        )
+        keep = bisect_right(list(accumulate(msg_tokens)), budget)
+        return conversations[len(conversations) - keep:]
@@ -1,7 +1,20 @@
 # file: ddb_agent/context/context_manager.py (处理超长单条消息)
 
+from bisect import bisect_left
+from itertools import accumulate
 from typing import List, Dict, Any
-from token_counter import count_tokens
+from token_counter import count_tokens, count_tokens_batch
+
+def _token_upper_bound(text: str) -> int:
+    """
+    An upper bound on the token count of `text` for byte-level BPE tokenizers:
+    every token covers at least one UTF-8 byte. (Characters are not a bound:
+    many CJK characters and emoji are split into 2-3 tokens.)
+    """
+    # 每个字符最多 4 个字节，纯 ASCII 文本无需编码即可得到精确字节数
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8'))
 
 class ContextManager:
     """
@@ -13,12 +26,19 @@ class ContextManager:
         self.max_window_size = max_window_size
         self.safe_zone_size = int(max_window_size * 0.9)
 
+    # 分词结果中可能额外加入的特殊 token (如 BOS) 的余量
+    SPECIAL_TOKENS_MARGIN = 16
+
     def _truncate_single_message(self, message: Dict[str, str]) -> Dict[str, str]:
         """
         Truncates a single message if it exceeds the safe zone size.
         A warning is added to the content indicating it has been truncated.
         """
         content = message.get('content', '')
+        # 每个 token 至少对应一个 UTF-8 字节 (外加少量特殊 token)，字节数明显小于安全区的消息不可能超限，无需分词。
+        # 注意不能用字符数：很多中文字符和 emoji 不在词表中，会被拆成 2-3 个字节级 token
+        if _token_upper_bound(content) + self.SPECIAL_TOKENS_MARGIN <= self.safe_zone_size:
+            return message
         message_tokens = count_tokens(content, model_name=self.model_name)
 
         if message_tokens > self.safe_zone_size:
@@ -57,7 +77,20 @@ class ContextManager:
         pre_processed_messages = [self._truncate_single_message(msg) for msg in messages]
 
         # --- 第2步：多消息整体剪枝层 (逻辑与之前类似) ---
-        total_tokens = self._count_total_tokens(pre_processed_messages)
+        # 快速路径：UTF-8 字节数是 token 数的上界，总字节数都在安全区内时一定不需要剪枝，不必分词；
+        # 否则 (如中文较多的长对话) 走下面的精确计数
+        byte_upper_bound = sum(
+            _token_upper_bound(msg.get('content', '')) + self.SPECIAL_TOKENS_MARGIN for msg in pre_processed_messages
+        )
+        if byte_upper_bound <= self.safe_zone_size:
+            print(f"Total tokens within safe zone (at most {byte_upper_bound}, bounded by UTF-8 length). No pruning needed.")
+            return pre_processed_messages
+
+        # 每条消息只计数一次，之后剪枝只需在总数上做减法
+        msg_tokens = count_tokens_batch(
+            [msg.get('content', '') for msg in pre_processed_messages], model_name=self.model_name
+        )
+        total_tokens = sum(msg_tokens)
 
         if total_tokens <= self.safe_zone_size:
             print(f"Total tokens within safe zone: {total_tokens}. No pruning needed.")
@@ -71,27 +104,27 @@ class ContextManager:
         if pre_processed_messages[0]['role'] == 'system':
             system_prompt = pre_processed_messages[0]
             workable_messages = pre_processed_messages[1:]
+            workable_tokens = msg_tokens[1:]
         else:
             workable_messages = pre_processed_messages
+            workable_tokens = msg_tokens
 
-        while self._count_total_tokens([system_prompt] + workable_messages if system_prompt else workable_messages) > self.safe_zone_size:
-            if not workable_messages:
-                # 经过单条消息截断后，这里几乎不可能再出现系统提示单独超长的情况
-                # 但保留这个检查以防万一
-                raise ValueError("System prompt alone exceeds the context window safe zone even after potential truncation.")
-            
-            removed_message = workable_messages.pop(0)
+        # 从最旧的消息开始丢弃：用前缀和二分查找最少需要丢弃多少条
+        excess = total_tokens - self.safe_zone_size
+        prefix = list(accumulate(workable_tokens))
+        cut = bisect_left(prefix, excess)
+        if cut == len(workable_messages):
+            # 经过单条消息截断后，这里几乎不可能再出现系统提示单独超长的情况
+            # 但保留这个检查以防万一
+            raise ValueError("System prompt alone exceeds the context window safe zone even after potential truncation.")
+        removed = cut + 1
+        total_tokens -= prefix[cut]
+        for removed_message in workable_messages[:removed]:
             print(f"  - Pruned historical message (role: {removed_message['role']}): '{removed_message['content'][:50]}...'")
 
+        workable_messages = workable_messages[removed:]
         final_messages = [system_prompt] + workable_messages if system_prompt else workable_messages
         
-        final_tokens = self._count_total_tokens(final_messages)
-        print(f"Pruning complete. Final token count: {final_tokens}")
+        print(f"Pruning complete. Final token count: {total_tokens}")
 
         return final_messages
-
-    def _count_total_tokens(self, messages: List[Dict[str, str]]) -> int:
-        if not messages:
-            return 0
-        full_text = "".join(msg.get('content', '') for msg in messages if msg) # 增加 if msg 保护
-        return count_tokens(full_text, model_name=self.model_name)
\ No newline at end of file
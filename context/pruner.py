@@ -2,21 +2,75 @@
 
 from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any
+from functools import cached_property
+from typing import List, Dict, Any, Optional
+import hashlib
 import json
+import os
+import re
+import threading
 
 from pydantic import BaseModel, Field, field_validator
 from llm.llm_prompt import llm
-from token_counter import count_tokens
-from utils.json_parser import parse_json_string 
+from token_counter import count_tokens, count_tokens_batch
+from utils.json_parser import dumps_json, parse_json_string 
+from utils.tokenizer import smart_tokenize
+from utils.sqlite_cache import SQLiteCache
+from utils.text_lines import line_starts
+
+# LLM 返回的 JSON 中不合法的反斜杠转义 (如 \*)
+_INVALID_JSON_ESCAPE_RE = re.compile(r'\\([^"\\/bfnrtu])')
+
+# LLM 抽取结果的持久缓存 (与计划缓存共用 SQLiteCache 实现，单独的文件和更短的 TTL)
+SNIPPET_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ddb_agent", "snippet_cache.sqlite3")
+SNIPPET_CACHE_TTL = 24 * 3600
+_snippet_cache: Optional[SQLiteCache] = None
+_snippet_cache_lock = threading.Lock()
+
+def _get_snippet_cache() -> SQLiteCache:
+    """Returns the process-wide snippet cache, opening it on first use."""
+    global _snippet_cache
+    if _snippet_cache is None:
+        with _snippet_cache_lock:
+            if _snippet_cache is None:
+                # DDB_PLAN_CACHE=0 同时关闭抽取结果的磁盘缓存，与之前共用 PlanCache 时一致
+                _snippet_cache = SQLiteCache(
+                    path=SNIPPET_CACHE_PATH,
+                    ttl_seconds=SNIPPET_CACHE_TTL,
+                    enabled=os.getenv("DDB_PLAN_CACHE", "1") != "0"
+                )
+    return _snippet_cache
+
 class Document:
     """A simple container for source code data."""
     def __init__(self, file_path: str, source_code: str, tokens: int = -1):
         self.file_path = file_path
         self.source_code = source_code
-        # 懒加载token计数，如果未提供
-        from token_counter import count_tokens # 局部导入避免循环依赖
-        self.tokens = tokens if tokens != None else count_tokens(source_code)
+        # 未提供 (tokens < 0) 时懒加载：首次访问 .tokens 才计数，不需要计数的文档不必分词
+        self._tokens = tokens if tokens is not None else -1
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens < 0:
+            # count_tokens 按内容缓存，同一文件内容只分词一次
+            self._tokens = count_tokens(self.source_code)
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, value: int):
+        self._tokens = value
+
+    @cached_property
+    def formatted(self) -> str:
+        """The document rendered as a RAG context block; built once per Document."""
+        return f"File: {self.file_path}\n\n{self.source_code}"
+
+def count_document_tokens(documents: List[Document], model_name: str = "deepseek-default"):
+    """Fills in the token count of every document that does not have one yet, with one batched tokenizer call."""
+    pending = [doc for doc in documents if doc._tokens < 0]
+    if pending:
+        for doc, tokens in zip(pending, count_tokens_batch([doc.source_code for doc in pending], model_name)):
+            doc.tokens = tokens
 
 class BasePruner(ABC):
     """
@@ -50,6 +104,19 @@ class BasePruner(ABC):
         return sum(source.tokens for source in sources)
     
 
+class NoOpPruner(BasePruner):
+    """
+    Keeps all file sources unchanged.
+    Used when the whole context is far below the model window, so no pruning work is needed.
+    """
+    def prune(
+        self, 
+        file_sources: List[Document], 
+        conversations: List[Dict[str, Any]]
+    ) -> List[Document]:
+        return file_sources
+
+
 class DeletePruner(BasePruner):
     """
     A simple pruner that discards files from the end of the list 
@@ -106,6 +173,14 @@ class ExtractPruner(BasePruner):
         self.llm_model_name = llm_model_name
         self.full_file_threshold = int(max_tokens * 0.8)
         self.max_workers = max_workers
+        # 抽取结果缓存的命中统计 (各工作线程共享)：命中数、未命中数、命中时省下的输入 token 数
+        self._cache_stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+        self._cache_stats_lock = threading.Lock()
+
+    # 合并到同一个抽取请求中的小文件的 token 总数上限
+    EXTRACT_BATCH_TOKENS = 8000
+    # 关键词重叠得分低于最佳文件得分的这个比例时，跳过该文件的 LLM 抽取
+    PREFILTER_RELATIVE_SCORE = 0.2
 
     @llm.prompt()
     def _extract_snippets_prompt(self, conversations: List[Dict[str, str]], content_with_lines: str) -> dict:
@@ -198,83 +273,290 @@ class ExtractPruner(BasePruner):
             "conversations": conversations,
             "full_content": full_content
         }
+
+    @llm.prompt()
+    def _extract_batch_content_prompt(self, conversations: List[Dict[str, str]], documents: List[Dict[str, str]]) -> dict:
+        """
+        You are an expert content analyst. Your task is to extract the most relevant text snippets from several source documents and score their relevance to a user's query.
+
+        Here is the conversation history. The last message is the user's primary request.
+        <CONVERSATION_HISTORY>
+        {% for msg in conversations %}
+        <{{ msg.role }}>: {{ msg.content }}
+        {% endfor %}
+        </CONVERSATION_HISTORY>
+
+        Your Task:
+        1. Analyze the user's request in the conversation.
+        2. For each document, identify and extract the most relevant continuous blocks of text/code.
+        3. For each extracted snippet, assign a relevance score from 0 to 10, where 10 is most relevant and 0 is not relevant at all.
+        4. Keep the snippets concise but complete. You can return up to 4 snippets per document.
+
+        Output Requirements:
+        - Your response MUST be a valid JSON object that maps each document id to a JSON array of objects.
+        - Each object must have two keys: "score" (an integer from 0-10) and "snippet" (a string).
+        - If no parts of a document are relevant, map its id to an empty array [].
+        - Do not include any text or explanations outside of the JSON object.
+
+        Example output:
+        ```json
+        {
+          "0": [
+            {
+              "score": 9,
+              "snippet": "def calculate_pnl(trades, prices):\\n    # ... implementation ...\\n    return pnl"
+            }
+          ],
+          "1": []
+        }
+        ```
+        <|user|>
+        Here are the source documents:
+        {% for doc in documents %}
+        <DOCUMENT id="{{ doc.id }}" path="{{ doc.path }}">
+        {{ doc.content }}
+        </DOCUMENT>
+        {% endfor %}
+        """
+        return {
+            "conversations": conversations,
+            "documents": documents
+        }
     
     def _merge_overlapping_snippets(self, snippets: List[Dict[str, int]]) -> List[Dict[str, int]]:
         """...""" # 实现不变
         if not snippets: return []
-        sorted_snippets = sorted(snippets, key=lambda x: x["start_line"])
-        merged = [sorted_snippets[0]]
-        for current in sorted_snippets[1:]:
+        intervals = sorted((s["start_line"], s["end_line"]) for s in snippets)
+        merged = [list(intervals[0])]
+        for start, end in intervals[1:]:
             last = merged[-1]
-            if current["start_line"] <= last["end_line"] + 1:
-                last["end_line"] = max(last["end_line"], current["end_line"])
+            if start <= last[1] + 1:
+                if end > last[1]:
+                    last[1] = end
             else:
-                merged.append(current)
-        return merged
+                merged.append([start, end])
+        return [{"start_line": start, "end_line": end} for start, end in merged]
 
     def _build_snippet_content(self, original_code: str, snippets: List[Dict[str, int]]) -> str:
         """...""" # 实现不变
-        lines = original_code.splitlines()
+        starts = line_starts(original_code, max((s["end_line"] for s in snippets), default=0))
+        num_lines = len(starts) - 1
         content_parts = ["# Snippets from the original file:\n"]
         for snippet in snippets:
             start = max(0, snippet["start_line"] - 1)
-            end = min(len(lines), snippet["end_line"])
+            end = min(num_lines, snippet["end_line"])
             content_parts.append(f"\n# ... (lines {start + 1}-{end}) ...\n")
-            content_parts.extend(lines[start:end])
+            if start < end:
+                content_parts.append(original_code[starts[start]:starts[end] - 1])
         return "\n".join(content_parts)
 
-    def _process_single_large_file(self, file_source: Document, conversations: List[Dict[str, Any]]) -> Document:
+    def _snippet_cache_key(self, file_source: Document, conversations: List[Dict[str, Any]]) -> str:
+        """(文件内容, 最后一条用户消息, 模型) 的指纹，作为抽取结果缓存的键。"""
+        last_user_msg = next(
+            (msg.get('content', '') for msg in reversed(conversations) if msg.get('role') == 'user'), ''
+        )
+        file_hash = hashlib.blake2b(file_source.source_code.encode('utf-8'), digest_size=16).hexdigest()
+        query_hash = hashlib.blake2b(last_user_msg.encode('utf-8'), digest_size=16).hexdigest()
+        return f"snippets:{file_hash}:{query_hash}:{self.llm_model_name}"
+
+    def _lookup_snippet_cache(self, file_source: Document, conversations: List[Dict[str, Any]]):
+        """Returns (cache_key, cached response or None) for `file_source` and records a hit or a miss."""
+        cache_key = self._snippet_cache_key(file_source, conversations)
+        cached = _get_snippet_cache().get(cache_key)
+        with self._cache_stats_lock:
+            if cached is not None:
+                self._cache_stats["hits"] += 1
+                self._cache_stats["tokens_saved"] += file_source.tokens
+            else:
+                self._cache_stats["misses"] += 1
+        if cached is not None:
+            print(f"  - Using cached snippets for: {file_source.file_path}")
+        return cache_key, cached
+
+    @staticmethod
+    def _parse_snippet_items(response_str: str) -> Any:
+        """Parses an extraction response, tolerating invalid backslash escapes in the LLM output."""
+        # 合法的 JSON (包括缓存中由 dumps_json 写入的结果) 直接解析，转义修复只会破坏其中的 "\\x" 等内容
+        try:
+            return json.loads(response_str)
+        except ValueError:
+            pass
+        # 将所有非法反斜杠转义为合法形式，例如 \* -> \\*
+        clean_json_str = _INVALID_JSON_ESCAPE_RE.sub(r'\\\\\1', response_str)
+        return parse_json_string(clean_json_str)
+
+    def _build_extracted_document(self, file_source: Document, json_items: Any) -> Document:
+        """Builds the pruned Document of `file_source` from the parsed `[{score, snippet}]` items."""
+        extracted_items = [ExtractedSnippet(**item) for item in json_items if isinstance(item, dict)]
+
+        # --- 关键：过滤掉低分数的片段 ---
+        # 我们可以设定一个阈值，比如只保留分数大于等于5的片段
+        score_threshold = 5
+        high_score_snippets = [item for item in extracted_items if item.score >= score_threshold]
+
+        if not high_score_snippets:
+            print(f"  - No snippets with score >= {score_threshold} found in {file_source.file_path}.")
+            return Document(file_source.file_path, "")
+        
+        # (可选) 可以按分数从高到低排序，让最重要的内容出现在前面
+        high_score_snippets.sort(key=lambda x: x.score, reverse=True)
+
+        # --- 构建新的内容 ---
+        new_content_parts = [
+            f"# Highly relevant snippets from {file_source.file_path} (filtered by score >= {score_threshold}):\n"
+        ]
+        for item in high_score_snippets:
+            # 在注释中包含分数，便于调试
+            new_content_parts.append(f"\n# Relevance Score: {item.score}\n---\n{item.snippet}\n")
+        
+        return Document(file_source.file_path, "".join(new_content_parts))
+
+    def _process_file_batch(self, batch: List[Document], conversations: List[Dict[str, Any]]) -> List[Document]:
+        """
+        Extracts snippets from several small files with a single LLM request, so the
+        conversation history is sent once per batch instead of once per file.
+        Files with a cached extraction result are not sent at all.
+        """
+        if len(batch) == 1:
+            return [self._process_single_large_file(batch[0], conversations)]
+
+        cache = _get_snippet_cache()
+        results: Dict[int, Document] = {}
+        pending = []
+        for i, file_source in enumerate(batch):
+            cache_key, cached = self._lookup_snippet_cache(file_source, conversations)
+            if cached is not None:
+                try:
+                    results[i] = self._build_extracted_document(file_source, self._parse_snippet_items(cached))
+                    continue
+                except Exception as e:
+                    print(f"  - Ignoring unreadable cached snippets for {file_source.file_path}: {e}")
+            pending.append((i, file_source, cache_key))
+
+        if len(pending) == 1:
+            i, file_source, cache_key = pending[0]
+            results[i] = self._process_single_large_file(file_source, conversations, cache_key)
+        elif pending:
+            print(f"  - Starting batched snippet extraction for {len(pending)} files: "
+                  f"{', '.join(f.file_path for _, f, _ in pending)}")
+            try:
+                response_str = self._extract_batch_content_prompt(
+                    conversations=conversations,
+                    documents=[
+                        {"id": str(n), "path": f.file_path, "content": f.source_code}
+                        for n, (_, f, _) in enumerate(pending)
+                    ]
+                )
+                items_by_doc = self._parse_snippet_items(response_str)
+                if not isinstance(items_by_doc, dict):
+                    raise ValueError(f"expected a JSON object, got {type(items_by_doc).__name__}")
+            except Exception as e:
+                print(f"  - Error in batched extraction, falling back to one request per file: {e}")
+                items_by_doc = None
+
+            for n, (i, file_source, cache_key) in enumerate(pending):
+                if items_by_doc is None:
+                    results[i] = self._process_single_large_file(file_source, conversations, cache_key)
+                    continue
+                json_items = items_by_doc.get(str(n))
+                if not isinstance(json_items, list):
+                    json_items = []
+                try:
+                    results[i] = self._build_extracted_document(file_source, json_items)
+                    # 按文件分别缓存，与单文件请求的缓存格式 (JSON 数组) 相同
+                    cache.put(cache_key, dumps_json(json_items))
+                except Exception as e:
+                    print(f"  - Error extracting content from {file_source.file_path}: {e}")
+                    results[i] = Document(file_source.file_path, "")
+
+        return [results[i] for i in range(len(batch))]
+
+    def _process_single_large_file(
+        self,
+        file_source: Document,
+        conversations: List[Dict[str, Any]],
+        cache_key: Optional[str] = None
+    ) -> Document:
         """
         Processes a single large file to extract snippets. This is the target for our threads.
         Returns a new Document object with pruned content, or the original if it fails.
+        A `cache_key` means the caller has already looked the file up in the cache and missed.
         """
         print(f"  - Starting snippet extraction for: {file_source.file_path}")
         try:
-        
-            response_str = self._extract_content_prompt(
-                conversations=conversations,
-                full_content=file_source.source_code
-            )
-
-            import re
-            # 将所有非法反斜杠转义为合法形式，例如 \* -> \\*
-            def escape_invalid_json_backslashes(s):
-                return re.sub(r'\\([^"\\/bfnrtu])', r'\\\\\1', s)
-
-            clean_json_str = escape_invalid_json_backslashes(response_str)
-
-            json_items = parse_json_string(clean_json_str)
-            extracted_items = [ExtractedSnippet(**item) for item in json_items if isinstance(item, dict)]
-            
-            # --- 关键：过滤掉低分数的片段 ---
-            # 我们可以设定一个阈值，比如只保留分数大于等于5的片段
-            score_threshold = 5
-            high_score_snippets = [item for item in extracted_items if item.score >= score_threshold]
-
-            if not high_score_snippets:
-                print(f"  - No snippets with score >= {score_threshold} found in {file_source.file_path}.")
-                return Document(file_source.file_path, "")
-            
-            # (可选) 可以按分数从高到低排序，让最重要的内容出现在前面
-            high_score_snippets.sort(key=lambda x: x.score, reverse=True)
-
-            # --- 构建新的内容 ---
-            new_content_parts = [
-                f"# Highly relevant snippets from {file_source.file_path} (filtered by score >= {score_threshold}):\n"
-            ]
-            for item in high_score_snippets:
-                # 在注释中包含分数，便于调试
-                new_content_parts.append(f"\n# Relevance Score: {item.score}\n---\n{item.snippet}\n")
-            
-            new_content = "".join(new_content_parts)
-
-            return Document(file_source.file_path, new_content)
+            # 抽取结果只取决于文件内容和用户请求，命中持久缓存时跳过整个 LLM 调用
+            if cache_key is None:
+                cache_key, response_str = self._lookup_snippet_cache(file_source, conversations)
+            else:
+                response_str = None
+            cache = _get_snippet_cache()
+            from_cache = response_str is not None
+            if not from_cache:
+                response_str = self._extract_content_prompt(
+                    conversations=conversations,
+                    full_content=file_source.source_code
+                )
+
+            json_items = self._parse_snippet_items(response_str)
+            if not isinstance(json_items, list):
+                raise ValueError(f"expected a JSON array, got {type(json_items).__name__}")
+            if not from_cache:
+                # 只缓存能正确解析的响应，API 错误等不会被缓存
+                cache.put(cache_key, response_str)
+
+            return self._build_extracted_document(file_source, json_items)
 
         except Exception as e:
             print(f"  - Error extracting content from {file_source.file_path}: {e}")
             return Document(file_source.file_path, "")
 
 
+    def _prefilter_files(self, files: List[Document], conversations: List[Dict[str, Any]]) -> List[Document]:
+        """
+        Drops files whose keyword overlap with the last user message is far below the
+        best-matching file's, before any of them is sent to the LLM.
+
+        The threshold is relative to the best score, so a query that shares no words
+        with any file (e.g. a Chinese question about English code) filters nothing.
+        """
+        last_user_msg = next(
+            (msg.get('content', '') for msg in reversed(conversations) if msg.get('role') == 'user'), ''
+        )
+        query_tokens = smart_tokenize(last_user_msg)
+        if len(files) <= 1 or not query_tokens:
+            return files
+
+        scores = [len(query_tokens & smart_tokenize(f.source_code)) / len(query_tokens) for f in files]
+        best = max(scores)
+        if best <= 0:
+            return files
+
+        kept = []
+        for source, score in zip(files, scores):
+            if score >= best * self.PREFILTER_RELATIVE_SCORE:
+                kept.append(source)
+            else:
+                print(f"  - Skipping {source.file_path}: keyword overlap {score:.2f} (best {best:.2f}).")
+        return kept
+
+    def _group_for_extraction(self, files: List[Document]) -> List[List[Document]]:
+        """Groups files into batches of at most EXTRACT_BATCH_TOKENS tokens; larger files get a batch of their own."""
+        batches: List[List[Document]] = []
+        current: List[Document] = []
+        current_tokens = 0
+        for source in files:
+            if source.tokens > self.EXTRACT_BATCH_TOKENS:
+                batches.append([source])
+                continue
+            if current and current_tokens + source.tokens > self.EXTRACT_BATCH_TOKENS:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(source)
+            current_tokens += source.tokens
+        if current:
+            batches.append(current)
+        return batches
+
     def prune(
         self, 
         file_sources: List[Document], 
@@ -293,6 +575,7 @@ class ExtractPruner(BasePruner):
             for source in file_sources:
                 if source is None: 
                     print("Warning: Encountered a None source in file_sources. Skipping.", file_sources)
+                    continue
                 if current_tokens + source.tokens <= self.full_file_threshold:
                     small_files.append(source)
                     current_tokens += source.tokens
@@ -303,47 +586,50 @@ class ExtractPruner(BasePruner):
         
        
 
-            # 测试
-            large_files += small_files  # 确保小文件也在后续处理列表中
+            # 与用户请求几乎没有关键词重叠的文件不值得一次 LLM 抽取调用，先用廉价的关键词打分过滤
+            large_files = self._prefilter_files(large_files, conversations)
             # 2. 并发处理大文件
             processed_large_files: List[Document] = []
             if large_files:
                 with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                    future_to_source = {
-                        executor.submit(self._process_single_large_file, source, conversations): source 
-                        for source in large_files
-                    }
+                    # 超过批大小的文件单独请求；较小的文件合并成批，每批只发送一次对话历史
+                    future_to_batch = {}
+                    for batch in self._group_for_extraction(large_files):
+                        future = executor.submit(self._process_file_batch, batch, conversations)
+                        future_to_batch[future] = batch
                     
-                    for future in as_completed(future_to_source):
+                    for future in as_completed(future_to_batch):
                         try:
-                            processed_source = future.result()
                             #if processed_source.tokens > 0: # 只保留有内容的
-                            processed_large_files.append(processed_source)
+                            processed_large_files.extend(future.result())
                         except Exception as exc:
-                            original_source = future_to_source[future]
-                            print(f"Exception processing {original_source.file_path}: {exc}")
+                            for original_source in future_to_batch[future]:
+                                print(f"Exception processing {original_source.file_path}: {exc}")
 
             # 3. 合并和最终剪枝
             # 将完整保留的小文件和处理后的大文件片段合并
             # 我们优先保留小文件，然后尝试添加处理后的大文件片段
             print("Merging results and performing final token check...")
             final_sources: List[Document] = []
-            # final_tokens = self._count_total_tokens(small_files)
-            # final_sources.extend(small_files)
-
-            final_tokens = 0
+            final_tokens = self._count_total_tokens(small_files)
+            final_sources.extend(small_files)
 
+            # 一次批量计算所有片段文档的 token 数，而不是排序时逐个分词
+            count_document_tokens(processed_large_files, self.llm_model_name)
             # 对处理后的大文件按（新）token数从小到大排序，优先添加小的
             processed_large_files.sort(key=lambda x: x.tokens)
 
             for source in processed_large_files:
                 if final_tokens + source.tokens <= self.max_tokens:
                     final_sources.append(source)
-                    final_tokens += count_tokens(source.source_code)
+                    final_tokens += source.tokens
                     print(f"  - Added snippets from {source.file_path} ({source.tokens} tokens)")
                 else:
                     print(f"  - Snippets from {source.file_path} ({source.tokens} tokens) too large to fit. Discarding.")
             
+            stats = self._cache_stats
+            print(f"Snippet cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"~{stats['tokens_saved']} input tokens saved.")
             print(f"Pruning complete. Final context has {len(final_sources)} files with {final_tokens} tokens.")
             return final_sources
         except Exception as e:
@@ -357,14 +643,16 @@ def get_pruner(strategy: str, max_tokens: int, **kwargs) -> BasePruner:
     Factory function to get a pruner instance based on the strategy name.
 
     Args:
-        strategy: The name of the strategy ('delete', 'extract').
+        strategy: The name of the strategy ('none', 'delete', 'extract').
         max_tokens: The maximum number of tokens allowed.
         **kwargs: Additional arguments for specific pruners (e.g., llm_model_name).
 
     Returns:
         An instance of a BasePruner subclass.
     """
-    if strategy == "delete":
+    if strategy == "none":
+        return NoOpPruner(max_tokens=max_tokens)
+    elif strategy == "delete":
         return DeletePruner(max_tokens=max_tokens)
     elif strategy == "extract":
         return ExtractPruner(max_tokens=max_tokens, **kwargs)
@@ -373,4 +661,4 @@ def get_pruner(strategy: str, max_tokens: int, **kwargs) -> BasePruner:
     #     return SummarizePruner(max_tokens=max_tokens, **kwargs)
     else:
         raise ValueError(f"Unknown pruning strategy: {strategy}. "
-                         "Available strategies: 'delete', 'extract'.")
\ No newline at end of file
+                         "Available strategies: 'none', 'delete', 'extract'.")
\ No newline at end of file
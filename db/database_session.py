@@ -1,5 +1,16 @@
 from typing import Any, Tuple
-import dolphindb as ddb
+
+# DolphinDB API 在连接断开时抛出的是普通异常，只能通过错误信息识别
+_CONNECTION_ERROR_MARKERS = (
+    "connection has been closed",
+    "Couldn't send script",
+    "Failed to connect",
+    "Connection refused",
+)
+
+# 清空会话中的全部用户变量和用户定义函数
+_RESET_SCRIPT = "undef all; undef(all, DEF)"
+
 class DatabaseSession:
     """数据库会话管理器"""
     def __init__(self, host: str, port: int, user: str, passwd: str, 
@@ -10,10 +21,13 @@ class DatabaseSession:
         self.passwd = passwd
         self.keep_alive_time = keep_alive_time
         self.reconnect = reconnect
+        # 延迟导入：dolphindb 会加载原生扩展，导入较慢，只在真正创建会话时才需要
+        import dolphindb as ddb
         self.session = ddb.session()
         self.logger = logger
 
-    def __enter__(self):
+    def connect(self):
+        """建立连接；用于在 with 语句之外长期持有会话 (如连接池)"""
         self.session.connect(
             self.host, 
             int(self.port), 
@@ -22,15 +36,30 @@ class DatabaseSession:
             keepAliveTime=self.keep_alive_time, 
             reconnect=self.reconnect
         )
-        return self 
+        return self
 
-    def __exit__(self, exc_type, exc_value, traceback):
+    def close(self):
         self.session.close()
+
+    def reset(self):
+        """清空会话中用户定义的变量和函数，使连接归还连接池后不影响下一个脚本"""
+        self.session.run(_RESET_SCRIPT)
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def execute(self, script: str) -> Tuple[bool, Any]:
-        """执行DolphinDB脚本并返回结果或错误"""
+        """执行DolphinDB脚本并返回结果或错误；连接层面的错误以 ConnectionError 抛出"""
         try:
             result = self.session.run(script)
             return True, result
+        except (ConnectionError, OSError):
+            raise
         except Exception as e:
-            return False, str(e) 
\ No newline at end of file
+            message = str(e)
+            if any(marker in message for marker in _CONNECTION_ERROR_MARKERS):
+                raise ConnectionError(message) from e
+            return False, message
@@ -1,10 +1,14 @@
 from dataclasses import dataclass
-import json
-from openai import OpenAI
-from typing import Generator, List, Dict, Any, Optional, Union
+from openai import AsyncOpenAI, OpenAI
+from typing import AsyncGenerator, Generator, List, Dict, Any, Optional, Union
 import os
 from loguru import logger
 
+from utils.json_parser import dumps_json
+
+# 非流式调用失败时，@llm.prompt 返回的错误信息以此开头
+MODEL_API_ERROR_PREFIX = "Model API error"
+
 @dataclass 
 class LLMResponse:
     """通用LLM响应结果容器"""
@@ -32,8 +36,15 @@ class LLMClient:
             raise ValueError("Base URL must be provided.")
         
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 异步客户端，供 asyncio 调用方在等待网络时让出事件循环
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
         self.logger = logger
 
+    @staticmethod
+    def _response_format_kwargs(response_format: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # 只在调用方要求结构化输出 (如 {"type": "json_object"}) 时才传入，保持其他请求不变
+        return {"response_format": response_format} if response_format else {}
+
     def _log_request(self, conversation_history: List[Dict[str, str]], model: str):
         """Helper method to log the request payload."""
         try:
@@ -46,8 +57,8 @@ class LLMClient:
                 "model": model,
                 "messages": conversation_history
             }
-            # 使用 pretty-printed JSON 格式，便于阅读
-            request_logger.debug(f"\n{json.dumps(log_content, indent=2, ensure_ascii=False)}")
+            # 使用 pretty-printed JSON 格式，便于阅读 (有 orjson 时用 orjson 序列化)
+            request_logger.debug(f"\n{dumps_json(log_content, indent=True)}")
         except Exception as e:
             logger.warning(f"Failed to log LLM request: {e}")
             
@@ -56,6 +67,7 @@ class LLMClient:
         conversation_history: List[Dict[str, str]], 
         model: Optional[str] = None,
         log_requests: bool = False,
+        response_format: Optional[Dict[str, Any]] = None,
     ) -> Generator[Union[str, LLMResponse], None, None]:
         """
         Streams the response from the LLM.
@@ -76,7 +88,8 @@ class LLMClient:
                 model=target_model,
                 messages=conversation_history,
                 max_completion_tokens=8000,
-                stream=True
+                stream=True,
+                **self._response_format_kwargs(response_format)
             )
 
             if self.logger:
@@ -108,11 +121,68 @@ class LLMClient:
                 error_type=type(e).__name__
             )
     
+    async def astream_generate_response(
+        self, 
+        conversation_history: List[Dict[str, str]], 
+        model: Optional[str] = None,
+        log_requests: bool = False,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[Union[str, LLMResponse], None]:
+        """
+        Async counterpart of `stream_generate_response`.
+
+        Yields:
+            str: Chunks of the response content.
+            LLMResponse: The final response object with metadata at the end.
+        """
+        try:
+            target_model = model or os.getenv("DEEPSEEK_MODEL")
+            if not target_model:
+                raise ValueError("No model specified and DEEPSEEK_MODEL environment variable is not set.")
+        
+            if log_requests:
+                self._log_request(conversation_history, target_model)
+
+            stream = await self.async_client.chat.completions.create(
+                model=target_model,
+                messages=conversation_history,
+                max_completion_tokens=8000,
+                stream=True,
+                **self._response_format_kwargs(response_format)
+            )
+
+            if self.logger:
+                self.logger.info(f"Streaming response from model: {target_model}...")
+            
+            content_parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    content_chunk = chunk.choices[0].delta.content
+                    content_parts.append(content_chunk)
+                    yield content_chunk
+
+            yield LLMResponse(
+                success=True,
+                content="".join(content_parts),
+                metadata={"model": target_model}
+            )
+
+        except Exception as e:
+            error_msg = f"DeepSeek API error: {str(e)}"
+            if self.logger:
+                self.logger.error(error_msg)
+            yield LLMResponse(
+                success=False,
+                error_message=error_msg,
+                error_type=type(e).__name__
+            )
+
     def generate_response(
         self, 
         conversation_history: List[Dict[str, str]],
         model: Optional[str] = None,
-        log_requests: bool = False
+        log_requests: bool = False,
+        response_format: Optional[Dict[str, Any]] = None
     ) -> LLMResponse:
         """从LLM获取响应
         
@@ -134,7 +204,8 @@ class LLMClient:
                 model=target_model,
                 messages=conversation_history,
                 max_completion_tokens=8000,
-                stream=True
+                stream=True,
+                **self._response_format_kwargs(response_format)
             )
 
             if self.logger:
@@ -167,7 +238,7 @@ class LLMClient:
             )
 
         except Exception as e:
-            error_msg = f"Model API error: {str(e)}"
+            error_msg = f"{MODEL_API_ERROR_PREFIX}: {str(e)}"
             if self.logger:
                 self.logger.error(error_msg)
             return LLMResponse(
@@ -1,5 +1,6 @@
 import functools
 import inspect
+import re
 from typing import Any, Callable, Dict, Optional, Type, TypeVar, List
 from jinja2 import Environment, BaseLoader
 
@@ -14,6 +15,25 @@ load_dotenv()
 T = TypeVar('T')
 
 CONVERSATION_HISTORY_PARAM = "conversation_history"
+# 模板中此标记之前的部分作为 system 消息发送，之后的部分作为最后一条 user 消息。
+# 不随调用变化的内容 (角色、规则、工具定义) 放在标记之前，构成稳定的前缀，可命中服务端的前缀缓存
+USER_SECTION_MARKER = "<|user|>"
+
+# 所有提示共享一个 Jinja 环境；模板在装饰时编译一次，运行时只做渲染
+_JINJA_ENV = Environment(loader=BaseLoader(), auto_reload=False)
+_TEMPLATE_VARIABLE_RE = re.compile(r"{{\s*(\w+)\s*}}")
+
+def _prepend_system_message(messages: List[Dict[str, str]], system_content: str) -> List[Dict[str, str]]:
+    """
+    Puts `system_content` in front of `messages` as the system message. If the
+    conversation history already starts with a system message, the two are merged
+    (template part first) so the request never carries two system messages.
+    """
+    if messages and messages[0].get("role") == "system":
+        merged = {**messages[0], "content": f"{system_content}\n\n{messages[0].get('content', '')}"}
+        return [merged] + messages[1:]
+    return [{"role": "system", "content": system_content}] + messages
+
 
 class PromptDecorator:
     """
@@ -26,6 +46,8 @@ class PromptDecorator:
                  response_model: Optional[Type] = None, 
                  stream: bool = False,
                  log_requests: Optional[bool] = None,
+                 use_async: bool = False,
+                 response_format: Optional[Dict[str, Any]] = None,
                  **kwargs):
         """
         初始化装饰器
@@ -33,6 +55,8 @@ class PromptDecorator:
         Args:
             response_model: 响应的数据模型类型
             stream: 是否启用流式响应
+            use_async: 与 stream 一起使用时，返回异步生成器 (AsyncGenerator) 而不是同步生成器
+            response_format: 透传给 API 的结构化输出参数，例如 {"type": "json_object"}
             **kwargs: 其他配置参数
         """
         self.model_name_alias = model
@@ -41,8 +65,10 @@ class PromptDecorator:
         self.response_model = response_model
         self.stream = stream
         self.override_log_requests = log_requests
+        self.use_async = use_async
+        self.response_format = response_format
         self.kwargs = kwargs
-        self.jinja_env = Environment(loader=BaseLoader())
+        self.jinja_env = _JINJA_ENV
         
     def __call__(self, func: Callable[..., Dict[str, Any]]) -> Callable:
         """
@@ -60,7 +86,13 @@ class PromptDecorator:
             raise ValueError(f"函数 {func.__name__} 缺少文档字符串作为提示模板")
         
         # 预编译模板
-        template = self.jinja_env.from_string(docstring)
+        system_template = None
+        if USER_SECTION_MARKER in docstring:
+            system_source, _, user_source = docstring.partition(USER_SECTION_MARKER)
+            system_template = self.jinja_env.from_string(system_source.strip())
+            user_template = self.jinja_env.from_string(user_source.strip())
+        else:
+            user_template = self.jinja_env.from_string(docstring)
 
          # 提取模板中的变量
         template_variables = self._extract_variables(docstring)
@@ -110,11 +142,7 @@ class PromptDecorator:
             missing_vars = [var for var in template_variables if var not in template_vars]
             
             if missing_vars:
-                # 尝试从函数参数中获取变量
-                # 首先绑定参数
-                bound_args = sig.bind(*args, **kwargs)
-                bound_args.apply_defaults()
-                
+                # 尝试从函数参数中获取变量 (使用上面已经绑定好的参数)
                 # 将参数添加到模板变量中
                 for var in missing_vars:
                     if var in bound_args.arguments:
@@ -126,11 +154,13 @@ class PromptDecorator:
                 raise ValueError(f"无法填充模板变量: {', '.join(missing_vars)}")
             
             # 渲染模板
-            rendered_prompt = template.render(**template_vars)
+            rendered_prompt = user_template.render(**template_vars)
 
             # 构建最终的LLM消息列表
-            # 将渲染后的prompt作为最后一轮的用户消息
+            # 将渲染后的prompt作为最后一轮的用户消息，静态部分 (如果有) 作为最前面的 system 消息
             llm_messages = conversation_history + [{"role": "user", "content": rendered_prompt}]
+            if system_template is not None:
+                llm_messages = _prepend_system_message(llm_messages, system_template.render(**template_vars))
 
             context_manager = ContextManager(
                 model_name=final_model_name, 
@@ -178,7 +208,7 @@ class PromptDecorator:
         def example_input():
             """返回使用示例输入的模板渲染结果"""
             example_vars = {k: f"example_{k}" for k in template_variables}
-            return template.render(**example_vars)
+            return self.jinja_env.from_string(docstring).render(**example_vars)
         
         wrapper.example_input = example_input
         
@@ -197,17 +227,26 @@ class PromptDecorator:
         llm_client = LLMClientManager.get_client(api_key=api_key, base_url=base_url)
 
 
-        if self.stream:
+        if self.stream and self.use_async:
+            return llm_client.astream_generate_response(
+                conversation_history=messages,
+                model=model,
+                log_requests=log_requests,
+                response_format=self.response_format
+            )
+        elif self.stream:
             return llm_client.stream_generate_response(
                 conversation_history=messages,
                 model=model,
-                log_requests=log_requests
+                log_requests=log_requests,
+                response_format=self.response_format
             )
         else:
             response = llm_client.generate_response(
                 conversation_history=messages,
                 model=model,
-                log_requests=log_requests
+                log_requests=log_requests,
+                response_format=self.response_format
             )
             if response.success:
                 return response.content
@@ -249,9 +288,7 @@ class PromptDecorator:
             变量名列表
         """
         # 简单实现，实际应用可能需要更复杂的解析
-        import re
-        pattern = r"{{\s*(\w+)\s*}}"
-        return re.findall(pattern, template_text)
+        return _TEMPLATE_VARIABLE_RE.findall(template_text)
 
 
 class LLM:
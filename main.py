@@ -317,9 +317,12 @@ class DDBAgentApp(App):
                     log_entry = f"[bold green]▶️ Step {step_num}: {action}[/bold green]\n[dim]   Thought: {thought}[/dim]"
                     self._write_to_log(Panel(log_entry, title=f"Step {step_num} Start", border_style="green"))
 
+                elif update_type == "step_partial":
+                    self._write_to_log(Text(f"   ⏳ {update.get('chunk', '')}", style="dim"))
+
                 elif update_type == "step_result":
                     observation = update.get('observation', '')
-                    obs_renderable = escape(observation)
+                    obs_renderable = escape(str(observation))
                     self._write_to_log(Panel(obs_renderable, title="[cyan]Observation[/cyan]", border_style="cyan"))
 
                 elif update_type == "final_result":
@@ -363,7 +366,11 @@ if __name__ == "__main__":
         )
 
         app = DDBAgentApp(agent=ddb_agent)
-        app.run()
+        try:
+            app.run()
+        finally:
+            # 显式释放线程池和数据库连接，并等待会话写盘完成
+            ddb_agent.close()
 
     except Exception as e:
         print(f"Failed to initialize or run the agent: {e}")
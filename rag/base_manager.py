@@ -4,6 +4,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import os
 import threading
+import time
 from typing import Any, List, Optional, Union
 
 import pydantic
@@ -16,11 +17,20 @@ class BaseIndexManager(ABC):
     """
     Abstract base class for all index managers (for code, text, etc.).
     """
+    # build_index 期间索引文件最多每隔这么多秒写盘一次 (而不是每个文件都完整重写一次)，结束时再写一次
+    BUILD_SAVE_INTERVAL = 10.0
+
     def __init__(self, project_path: str, index_file: str):
         self.project_path = project_path
         self.index_path = os.path.join(project_path, index_file)
         self.project_index: ProjectIndex = self._load_index()
         self._index_lock = threading.Lock()
+        # file_path -> 索引项 的查找表，按需构建，索引更新后失效
+        self._index_map: Optional[dict] = None
+        # build_index 运行期间为 True：更新先留在内存中，按 BUILD_SAVE_INTERVAL 批量写盘
+        self._defer_saves = False
+        self._index_dirty = False
+        self._last_save = 0.0
 
     def get_all_indices(self) -> List[BaseIndexModel]:
         return self.project_index.files
@@ -58,9 +68,15 @@ class BaseIndexManager(ABC):
             # Iterate over the list and update the index
             for item in new_item:
                 self._update_internal_index(item)
+            self._index_map = None
             
             # Save the index
-            self._save_index()
+            if self._defer_saves and time.monotonic() - self._last_save < self.BUILD_SAVE_INTERVAL:
+                self._index_dirty = True
+            else:
+                self._save_index()
+                self._last_save = time.monotonic()
+                self._index_dirty = False
 
     @abstractmethod
     def _update_internal_index(self, new_item: BaseIndexModel):
@@ -73,7 +89,10 @@ class BaseIndexManager(ABC):
     def _load_index(self) -> ProjectIndex:
         if os.path.exists(self.index_path):
             try:
-                return ProjectIndex.model_validate_json(open(self.index_path, 'r', encoding='utf-8').read())
+                # 以字节读入并直接交给 pydantic 解析 (其 JSON 解析器直接处理 UTF-8 字节)，
+                # 省去把整个索引文件先解码成 str 的一次完整拷贝
+                with open(self.index_path, 'rb') as f:
+                    return ProjectIndex.model_validate_json(f.read())
             
             # 捕获 Pydantic 的 ValidationError
             except (json.JSONDecodeError, pydantic.ValidationError) as e:
@@ -109,9 +128,11 @@ class BaseIndexManager(ABC):
         Returns:
             The CodeIndex object if found, otherwise None.
         """
-        # 为了提高查找效率，我们可以构建一个临时的字典映射
-        # 如果频繁调用，可以将这个映射作为 DDBIndexManager 的一个属性
-        index_map = {f.file_path: f for f in self.project_index.files}
+        # 查找表只在索引变化后重建一次，之后每次查找都是 O(1)
+        index_map = self._index_map
+        if index_map is None:
+            index_map = {f.file_path: f for f in self.project_index.files}
+            self._index_map = index_map
         return index_map.get(file_path)
 
     def _discover_files(self, file_extensions: Optional[Union[str, List[str]]]) -> List[str]:
@@ -127,7 +148,7 @@ class BaseIndexManager(ABC):
                 extensions = [file_extensions]
             else:
                 extensions = file_extensions
-            extensions = [ext if ext.startswith('.') else '.' + ext for ext in extensions]
+            extensions = tuple(ext if ext.startswith('.') else '.' + ext for ext in extensions)
         else:
             extensions = None
 
@@ -135,7 +156,7 @@ class BaseIndexManager(ABC):
             dirs[:] = [d for d in dirs if d not in ignore_dirs]
             
             for file in files:
-                if extensions is None or any(file.endswith(ext) for ext in extensions):
+                if extensions is None or file.endswith(extensions):
                     full_path = os.path.join(root, file)
                     #relative_path = os.path.relpath(full_path, self.project_path)
                     discovered_files.append(full_path)
@@ -162,6 +183,22 @@ class BaseIndexManager(ABC):
         print(f"Found {len(file_paths_to_index)} files to build index...")
 
         # 2. 使用 ThreadPoolExecutor 并发处理文件
+        self._defer_saves = True
+        try:
+            self._process_files(file_paths_to_index, max_workers)
+        finally:
+            # 把尚未写盘的更新一次性保存
+            with self._index_lock:
+                self._defer_saves = False
+                if self._index_dirty:
+                    self._save_index()
+                    self._last_save = time.monotonic()
+                    self._index_dirty = False
+
+        print("Index building complete. All processed files have been saved.")
+
+    def _process_files(self, file_paths_to_index: List[str], max_workers: int):
+        """Indexes the given files concurrently, merging each result into the index."""
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_filepath = {executor.submit(self._process_single_file, fp): fp for fp in file_paths_to_index}
             
@@ -177,12 +214,9 @@ class BaseIndexManager(ABC):
                         # --- 核心修改在这里 ---
                         # 调用线程安全的更新和保存方法
                         self._add_or_update_and_save(result_index)
-                        print(f"[{processed_count}/{len(file_paths_to_index)}] Indexed and saved: {file_path}")
+                        print(f"[{processed_count}/{len(file_paths_to_index)}] Indexed: {file_path}")
                     else:
                         print(f"[{processed_count}/{len(file_paths_to_index)}] Failed to index (skipped): {file_path}")
                 except Exception as exc:
                     print(f"[{processed_count}/{len(file_paths_to_index)}] Exception for {file_path}: {exc}")
-        
-        
-        print("Index building complete. All processed files have been saved incrementally.")
     
\ No newline at end of file
@@ -7,7 +7,7 @@ import re
 from rag.base_manager import BaseIndexManager
 from rag.types import BaseIndexModel
 from token_counter import count_tokens
-from utils.json_parser import parse_json_string
+from utils.json_parser import dumps_json, parse_json_string
 from utils.tokenizer import smart_tokenize 
 from llm.llm_prompt import llm
 
@@ -146,7 +146,7 @@ class LLMCandidateSelector:
     def _select_candidates_from_chunk(self, query: str, index_chunk: List[Dict]) -> List[Dict]:
         """The target function for each thread, processing one chunk."""
         try:
-            chunk_json_str = json.dumps(index_chunk, indent=2, ensure_ascii=False)
+            chunk_json_str = dumps_json(index_chunk, indent=True)
             response_str = self._select_from_chunk_prompt(
                 user_query=query,
                 index_chunk_json=chunk_json_str
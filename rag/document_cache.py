@@ -0,0 +1,50 @@
+# file: ddb_agent/rag/document_cache.py
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from context.pruner import Document
+
+
+class DocumentCache:
+    """
+    An in-memory LRU cache of `Document` objects keyed by file path.
+
+    An entry is only reused while the file's (mtime_ns, size) is unchanged, so an
+    edited file is re-read on its next lookup. Cached documents keep their token
+    count, so unchanged files are neither re-read nor re-tokenized across turns.
+    """
+    DEFAULT_MAX_ENTRIES = 2048
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # full_path -> ((mtime_ns, size), Document)
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Document]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, full_path: str, file_path: str, tokens: Optional[int] = -1) -> Document:
+        """
+        Returns the Document for `full_path`, reading the file only if it is not
+        cached or has changed on disk. Raises OSError / UnicodeDecodeError like open().
+        """
+        stat = os.stat(full_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(full_path)
+            if entry is not None and entry[0] == version and entry[1].file_path == file_path:
+                self._entries.move_to_end(full_path)
+                return entry[1]
+
+        with open(full_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        document = Document(file_path, content, tokens)
+
+        with self._lock:
+            self._entries[full_path] = (version, document)
+            self._entries.move_to_end(full_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return document
@@ -2,22 +2,27 @@
 
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-from context.pruner import Document, get_pruner
+from context.pruner import Document, count_document_tokens, get_pruner
 from llm.llm_prompt import llm
 from typing import Dict, List
 
 from llm.models import ModelManager
 from rag.types import BaseIndexModel
-from utils.json_parser import parse_json_string
+from utils.json_parser import dumps_json, parse_json_string
 from .code_index_manager import CodeIndexManager
 from .text_index_manager import TextIndexManager
 from .candidate_selector import CandidateSelector, LLMCandidateSelector 
+from .document_cache import DocumentCache
 
 class DDBRAG:
     """
     A simple RAG implementation for DolphinDB agent.
     """
+    # Reciprocal Rank Fusion 的平滑常数
+    RRF_K = 60
+
     def __init__(self, project_path: str, index_file: str = None, selection_strategy: str = 'llm' ):
         """ 
             selection_strategy: 处理索引过大场景
@@ -26,6 +31,15 @@ class DDBRAG:
         self.index_file = index_file or os.path.join(project_path, ".ddb_agent", "file_index.json")
         self.index_manager = TextIndexManager(project_path=project_path, index_file = self.index_file)
         self.selection_strategy = selection_strategy
+        self.document_cache = DocumentCache()
+
+    @property
+    def index_version(self) -> float:
+        """Changes whenever the index file is rewritten (its mtime); 0.0 if there is no index."""
+        try:
+            return os.path.getmtime(self.index_manager.index_path)
+        except OSError:
+            return 0.0
 
     @llm.prompt()
     def _chat_prompt(self, user_query: str, context_files: str) -> str:
@@ -81,7 +95,7 @@ class DDBRAG:
         pass
 
     @llm.prompt()
-    def _rerank_candidates_prompt(self, user_query: str, candidates_json: str) -> str:
+    def _rerank_candidates_prompt(self, user_query: str, candidates_json: str, top_k: int) -> str:
         """
         You are an expert re-ranking system. Your task is to analyze a list of candidate documents
         and select the most relevant ones for the given user query.
@@ -95,7 +109,7 @@ class DDBRAG:
         </CANDIDATES>
 
         Please review the candidates and return a JSON list of the file paths (`module_name` or `source_document`) 
-        or chunk IDs (`chunk_id`) of the TOP 5 most relevant items. Order them from most to least relevant.
+        or chunk IDs (`chunk_id`) of the TOP {{ top_k }} most relevant items. Order them from most to least relevant.
 
         Your response MUST be a valid JSON list of strings.
         Example:
@@ -109,20 +123,77 @@ class DDBRAG:
         """
         pass
 
+    @llm.prompt()
+    def _query_variants_prompt(self, user_query: str, n: int) -> str:
+        """
+        You are helping a search system over DolphinDB documentation and code.
+        Rewrite the user query below into {{ n }} different search queries that
+        express the same information need with different wording, keywords or focus.
+
+        User Query:
+        {{ user_query }}
+
+        Your response MUST be a valid JSON list of {{ n }} strings, and nothing else.
+        """
+        pass
+
+    def generate_query_variants(self, query: str, n: int = 3) -> List[str]:
+        """Asks the LLM for `n` rephrasings of `query`. Returns an empty list on failure."""
+        response_str = self._query_variants_prompt(user_query=query, n=n)
+        try:
+            variants = parse_json_string(response_str)
+        except Exception as e:
+            print(f"Error parsing query variants: {e}")
+            return []
+        if not isinstance(variants, list):
+            return []
+        return [v for v in variants if isinstance(v, str) and v.strip() and v != query][:n]
+
+    def retrieve_multi(self, queries: List[str], top_k: int = 5) -> List[Document]:
+        """
+        Retrieves documents for several query variants in parallel and fuses the
+        rankings with Reciprocal Rank Fusion: score(doc) = sum(1 / (RRF_K + rank)).
+        """
+        queries = list(dict.fromkeys(q for q in queries if q))
+        if not queries:
+            return []
+        if len(queries) == 1:
+            return self.retrieve(queries[0], top_k=top_k)
+
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            results = list(executor.map(lambda q: self.retrieve(q, top_k=top_k), queries))
+
+        scores: Dict[str, float] = {}
+        documents: Dict[str, Document] = {}
+        for ranked_docs in results:
+            for rank, doc in enumerate(ranked_docs, start=1):
+                scores[doc.file_path] = scores.get(doc.file_path, 0.0) + 1.0 / (self.RRF_K + rank)
+                documents.setdefault(doc.file_path, doc)
+
+        fused = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        print(f"RAG-Fusion: merged {sum(len(r) for r in results)} results from {len(queries)} queries into {len(fused)} documents.")
+        return [documents[path] for path in fused]
+
     def _get_files_content(self, file_paths: List[str]) -> List[Document]:
-        """Reads file contents and creates Document objects."""
+        """Reads file contents and creates Document objects. Duplicate paths are read only once."""
         sources = []
+        seen_paths = set()
         for file_path in file_paths:
+            # LLM 精排可能返回重复的标识符，重复的文件只会浪费上下文预算
+            if file_path in seen_paths:
+                continue
+            seen_paths.add(file_path)
             full_path = os.path.join(self.project_path, file_path)
             try:
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
                 # 从索引中获取预先计算好的token数
                 index_info = self.index_manager.get_index_by_filepath(file_path)
                 tokens = index_info.tokens if index_info else -1 # 如果找不到索引，则让Document自己计算
-                sources.append(Document(file_path, content, tokens))
+                # 未修改的文件直接复用上一轮读取 (及计数) 过的 Document
+                sources.append(self.document_cache.get(full_path, file_path, tokens))
             except Exception as e:
                 print(f"Warning: Could not read file {file_path}: {e}")
+        # 索引中没有 token 数的文件，一次批量计数
+        count_document_tokens(sources)
         return sources
     
     
@@ -163,13 +234,14 @@ class DDBRAG:
         print("candidates:", candidates)
         candidates_for_llm = [c.model_dump() for c in candidates if c is not None]
         #  然后再对这个字典列表进行 JSON 序列化
-        candidates_json_str = json.dumps(candidates_for_llm, indent=2, ensure_ascii=False)
+        candidates_json_str = dumps_json(candidates_for_llm, indent=True)
 
         print("candidates_json_str:", candidates_json_str)
         
         response_str = self._rerank_candidates_prompt(
             user_query=query,
-            candidates_json=candidates_json_str
+            candidates_json=candidates_json_str,
+            top_k=top_k
         )
         
         try:
@@ -182,6 +254,7 @@ class DDBRAG:
                 c.get('module_name') or c.get('chunk_id') for c in candidates
             ]
 
+        final_identifiers = final_identifiers[:top_k]
         print(f"LLM selected and re-ranked {len(final_identifiers)} items.")
 
         # 4. 根据最终的标识符列表，获取并返回文件/文本块内容
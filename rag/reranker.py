@@ -0,0 +1,77 @@
+# file: ddb_agent/rag/reranker.py
+
+import re
+import threading
+from typing import List
+
+from context.pruner import Document
+
+# FlagEmbedding 是可选依赖，未安装时保持检索器给出的顺序
+try:
+    from FlagEmbedding import FlagReranker
+    FLAG_EMBEDDING_AVAILABLE = True
+except ImportError:
+    FLAG_EMBEDDING_AVAILABLE = False
+
+# 形如 `utils/foo.dos` 的文件名，或被引号包裹的短语
+_LITERAL_QUERY_RE = re.compile(r'^(?:[\w./\\-]+\.\w{1,6}|"[^"]+"|\'[^\']+\'|“[^”]+”)$')
+
+
+class Reranker:
+    """
+    Re-orders retrieved documents by their relevance to the query.
+
+    Uses the `bge-reranker-v2-m3` cross-encoder when `FlagEmbedding` is installed.
+    Without it, the retriever's own ordering (e.g. the LLM re-ranking) is kept and
+    only truncated: a cruder signal such as keyword overlap would make it worse.
+    """
+    MAX_DOC_CHARS = 2048
+
+    def __init__(self, model_name: str = "BAAI/bge-reranker-v2-m3", use_fp16: bool = True):
+        self.model_name = model_name
+        self.use_fp16 = use_fp16
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    def _get_model(self):
+        """Lazily loads the cross-encoder so startup does not pay for it."""
+        if self._model is None and FLAG_EMBEDDING_AVAILABLE:
+            with self._load_lock:
+                if self._model is None:
+                    print(f"Loading reranker model: {self.model_name}...")
+                    self._model = FlagReranker(self.model_name, use_fp16=self.use_fp16)
+        return self._model
+
+    def warmup(self):
+        """Loads the model ahead of the first `rerank` call. Safe to call from a background thread."""
+        self._get_model()
+
+    @property
+    def available(self) -> bool:
+        """Whether a cross-encoder can be used, i.e. `rerank` does more than truncate."""
+        return FLAG_EMBEDDING_AVAILABLE
+
+    def rerank(self, query: str, candidates: List[Document], top_n: int = 5) -> List[Document]:
+        """
+        Returns the `top_n` most relevant documents from `candidates`, best first.
+        """
+        if len(candidates) <= 1:
+            return candidates[:top_n]
+
+        # 查询本身是文件名或引号短语时，精确匹配比语义打分更可靠，直接短路
+        stripped_query = query.strip()
+        if _LITERAL_QUERY_RE.match(stripped_query):
+            literal = stripped_query.strip('"\'“”')
+            exact = [d for d in candidates if literal in d.file_path or literal in d.source_code]
+            rest = [d for d in candidates if d not in exact]
+            return (exact + rest)[:top_n]
+
+        model = self._get_model()
+        if model is None:
+            return candidates[:top_n]
+        scores = model.compute_score(
+            [[query, doc.source_code[:self.MAX_DOC_CHARS]] for doc in candidates]
+        )
+
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda x: x[0], reverse=True)
+        return [candidates[i] for _, i in ranked[:top_n]]
@@ -5,7 +5,7 @@ import json
 from typing import List, Tuple
 from llm.llm_prompt import llm
 from token_counter import count_tokens
-from utils.json_parser import parse_json_string
+from utils.json_parser import dumps_json, parse_json_string
 from .types import TextChunkIndex
 from utils.text_extractor import extract_text_from_file
 from .base_manager import BaseIndexManager
@@ -139,7 +139,8 @@ class TextIndexManager(BaseIndexManager):
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
         with open(self.index_path, 'w', encoding='utf-8') as f:
             #f.write(self.project_index.model_dump_json(indent=2))
-            json.dump(self.project_index.model_dump(), f, indent=2, ensure_ascii=False)
+            # 先整体序列化 (有 orjson 时用 orjson) 再一次写盘
+            f.write(dumps_json(self.project_index.model_dump(), indent=True))
 
     def _update_internal_index(self, new_item: TextChunkIndex):
         """Updates the in-memory ProjectIndex with a new CodeIndex."""
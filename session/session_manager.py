@@ -1,11 +1,98 @@
 # file: ddb_agent/session/session_manager.py
 
+import atexit
 import os
 import json
+import queue
+import threading
+import time
 import uuid
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional
 
+from loguru import logger
+
+
+class SessionWriter:
+    """
+    Writes session snapshots to disk on a background daemon thread.
+
+    Snapshots enqueued within DEBOUNCE_SECONDS of each other are coalesced: only the
+    latest snapshot per file is written. One writer is shared by every SessionManager
+    in the process (see `get_session_writer`); pending writes are flushed at interpreter exit.
+    """
+    DEBOUNCE_SECONDS = 0.1
+
+    def __init__(self):
+        self._queue: "queue.Queue[tuple[str, Dict[str, Any]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='ddb-session-writer', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, path: str, snapshot: Dict[str, Any]):
+        self._queue.put((path, snapshot))
+
+    def flush(self):
+        """Blocks until every enqueued snapshot has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, snapshot = self._queue.get()
+            taken = 1
+            try:
+                time.sleep(self.DEBOUNCE_SECONDS)
+                # 合并等待期间到达的快照，每个文件只写最新的一份
+                pending = {path: snapshot}
+                while True:
+                    try:
+                        path, snapshot = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    pending[path] = snapshot
+                    taken += 1
+                for path, snapshot in pending.items():
+                    self._write(path, snapshot)
+            except Exception:
+                # 任何意外错误都不能让写盘线程退出，否则之后的 flush() 会永远阻塞
+                logger.exception("Unexpected error in the session writer thread")
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    @staticmethod
+    def _write(path: str, snapshot: Dict[str, Any]):
+        # 在后台线程中运行：不能 print，否则会打乱 Textual 界面，统一走 loguru
+        tmp_path = f"{path}.tmp"
+        try:
+            # 保持原有的 indent=2 格式，会话文件仍便于人工查看。
+            # 先写临时文件再原子替换：写入中途失败时，原来的会话文件保持完整
+            content = json.dumps(snapshot, ensure_ascii=False, indent=2)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            logger.debug(f"Session saved to: {path}")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Could not save session file {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+_session_writer: Optional[SessionWriter] = None
+_session_writer_lock = threading.Lock()
+
+def get_session_writer() -> SessionWriter:
+    """Returns the process-wide SessionWriter, starting its thread (and exit hook) on first use."""
+    global _session_writer
+    if _session_writer is None:
+        with _session_writer_lock:
+            if _session_writer is None:
+                _session_writer = SessionWriter()
+                atexit.register(_session_writer.flush)
+    return _session_writer
+
+
 class SessionManager:
     """
     Manages loading, saving, and accessing the persistent conversation history for a session.
@@ -13,6 +100,8 @@ class SessionManager:
     def __init__(self, project_path: str, session_file: str = ".ddb_agent/session.json"):
         self.session_path = os.path.join(project_path, session_file)
         self.session_data: Dict[str, Any] = self._load_or_create_session()
+        # 所有 SessionManager 共用一个写盘线程
+        self._writer = get_session_writer()
 
     def _load_or_create_session(self) -> Dict[str, Any]:
         """
@@ -44,15 +133,18 @@ class SessionManager:
 
     def save_session(self):
         """
-        Saves the current session data to the disk.
+        Saves the current session data to the disk. The write happens on a background
+        thread (see `SessionWriter`); call `flush()` to wait for it.
         """
         self.session_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-        try:
-            with open(self.session_path, 'w', encoding='utf-8') as f:
-                json.dump(self.session_data, f, indent=2, ensure_ascii=False)
-            print(f"Session saved to: {self.session_path}")
-        except IOError as e:
-            print(f"Error: Could not save session file. {e}")
+        # 快照：之后追加的消息不会影响正在排队的这次写入
+        snapshot = dict(self.session_data)
+        snapshot['conversation_history'] = list(self.session_data.get('conversation_history', []))
+        self._writer.enqueue(self.session_path, snapshot)
+
+    def flush(self):
+        """Blocks until all pending session writes have reached the disk."""
+        self._writer.flush()
 
     def get_history(self) -> List[Dict[str, Any]]:
         """
@@ -80,6 +172,8 @@ class SessionManager:
         """
         Archives the current session (if it has history) and starts a new one.
         """
+        # 确保排队中的写入已完成，避免旧会话在归档后又被写回
+        self.flush()
         if self.get_history():
              # (可选) 归档旧会话，而不是直接覆盖
             archive_dir = os.path.join(os.path.dirname(self.session_path), "history")
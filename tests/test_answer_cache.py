@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from agent.agent import DDBAgent
+from agent.semantic_cache import SemanticCache
+from llm.llm_client import MODEL_API_ERROR_PREFIX
+
+
+class FakeSessionManager:
+    """In-memory stand-in for SessionManager: no files, no writer thread."""
+    def __init__(self):
+        self.history = []
+
+    def get_history(self):
+        return self.history
+
+    def add_message(self, role, content):
+        self.history.append({"role": role, "content": content})
+
+    def save_session(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def new_session(self):
+        self.history = []
+
+
+def _make_agent():
+    # 只构造 run_task 的缓存路径用到的部分，不检索、不调用真实的 LLM
+    agent = DDBAgent.__new__(DDBAgent)
+    agent.session_manager = FakeSessionManager()
+    agent.semantic_cache = SemanticCache(threshold=DDBAgent.ANSWER_CACHE_THRESHOLD, max_size=DDBAgent.ANSWER_CACHE_SIZE)
+    agent.rag = SimpleNamespace(index_version=1.0)
+    agent._retrieval_cache = OrderedDict()
+    agent._retrieval_lock = threading.Lock()
+    agent._retrieval_semantic_cache = SemanticCache()
+    agent._build_task_messages = lambda user_input, task_type: [{"role": "user", "content": user_input}]
+
+    llm_calls = []
+
+    def chat_prompt(conversation_history):
+        llm_calls.append(conversation_history[-1]["content"])
+        return f"answer {len(llm_calls)}"
+
+    agent.chat_prompt_func = chat_prompt
+    return agent, llm_calls
+
+
+def test_repeated_standalone_question_does_not_reach_the_llm():
+    agent, llm_calls = _make_agent()
+
+    first = agent.run_task("how do I create a DFS table?")
+    agent.start_new_session()
+    second = agent.run_task("How do I create a DFS table")
+
+    assert first == second == "answer 1"
+    assert llm_calls == ["how do I create a DFS table?"]
+    # 命中缓存的回答同样记入新会话的历史
+    assert agent.session_manager.history[-1] == {"role": "assistant", "content": "answer 1"}
+
+
+def test_follow_up_questions_are_not_cached():
+    agent, llm_calls = _make_agent()
+
+    agent.run_task("how do I create a DFS table?")
+    agent.run_task("explain it")
+    agent.start_new_session()
+    agent.run_task("what is a stream table?")
+    agent.run_task("explain it")
+
+    assert llm_calls == ["how do I create a DFS table?", "explain it", "what is a stream table?", "explain it"]
+
+
+def test_rebuilt_index_invalidates_cached_answers():
+    agent, llm_calls = _make_agent()
+
+    agent.run_task("how do I create a DFS table?")
+    agent.start_new_session()
+    agent.rag.index_version = 2.0
+    agent.run_task("how do I create a DFS table?")
+
+    assert len(llm_calls) == 2
+
+
+def test_only_chat_answers_are_cached():
+    agent, llm_calls = _make_agent()
+
+    agent.run_task("write a script that creates a DFS table", task_type="coding")
+    agent.start_new_session()
+    agent.run_task("write a script that creates a DFS table", task_type="coding")
+
+    assert len(llm_calls) == 2
+
+
+def test_model_errors_are_not_cached():
+    agent, llm_calls = _make_agent()
+    agent.chat_prompt_func = lambda conversation_history: llm_calls.append(1) or f"{MODEL_API_ERROR_PREFIX} timeout"
+
+    agent.run_task("how do I create a DFS table?")
+    agent.start_new_session()
+    agent.run_task("how do I create a DFS table?")
+
+    assert len(llm_calls) == 2
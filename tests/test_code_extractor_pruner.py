@@ -0,0 +1,41 @@
+from context.code_extractor_pruner import CodeExtractorPruner, Document
+
+
+def _file(path, tokens):
+    return Document(path, "\n".join(f"line {n}" for n in range(1, 21)), tokens=tokens)
+
+
+def _make_pruner(max_tokens=100000):
+    pruner = CodeExtractorPruner(max_tokens=max_tokens)
+    pruner.EXTRACT_BATCH_TOKENS = 1000
+    requests = []
+
+    def fake_extract(conversations, files):
+        requests.append([f["path"] for f in files])
+        return {f["id"]: [{"start_line": 2, "end_line": 3}] for f in files}
+
+    pruner._extract_snippets_prompt = fake_extract
+    return pruner, requests
+
+
+def test_large_files_are_extracted_in_token_budgeted_batches():
+    pruner, requests = _make_pruner(max_tokens=5000)
+    # full_file_threshold = 4000：第一个文件完整保留，其余文件需要抽取
+    files = [_file("keep.dos", 3900), _file("a.dos", 600), _file("b.dos", 600), _file("huge.dos", 3000), _file("c.dos", 300)]
+
+    result = pruner.prune(files, [{"role": "user", "content": "query"}])
+
+    assert requests == [["a.dos"], ["b.dos"], ["huge.dos"], ["c.dos"]]
+    assert [doc.file_path for doc in result] == ["keep.dos", "a.dos", "b.dos", "huge.dos", "c.dos"]
+    assert "line 2\nline 3" in result[1].source_code
+
+
+def test_files_that_fit_together_share_one_request():
+    pruner, requests = _make_pruner(max_tokens=1000)
+    # full_file_threshold = 800：keep.dos 完整保留，b 和 c 合在一次请求中抽取
+    files = [_file("keep.dos", 700), _file("b.dos", 400), _file("c.dos", 400)]
+
+    result = pruner.prune(files, [{"role": "user", "content": "query"}])
+
+    assert requests == [["b.dos", "c.dos"]]
+    assert [doc.file_path for doc in result] == ["keep.dos", "b.dos", "c.dos"]
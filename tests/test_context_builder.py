@@ -0,0 +1,27 @@
+import context.context_builder as context_builder_module
+from context.context_builder import ContextBuilder
+from context.pruner import Document
+
+
+class DropFirstPruner:
+    def prune(self, file_sources, conversations):
+        return file_sources[1:]
+
+
+def test_file_rank_is_the_original_retrieval_rank(monkeypatch):
+    monkeypatch.setattr(context_builder_module, "get_pruner", lambda **kwargs: DropFirstPruner())
+    builder = ContextBuilder(model_name="deepseek-default", max_window_size=2000)
+    files = [
+        Document("c.dos", "x = 1", tokens=1000),
+        Document("b.dos", "y = 2", tokens=1000),
+        Document("a.dos", "z = 3", tokens=1000),
+    ]
+
+    messages = builder.build("system", [{"role": "user", "content": "question"}], files)
+
+    content = messages[-1]["content"]
+    # 按路径排序，但排名仍是剪枝前检索结果中的位置
+    assert "File: a.dos (rank 3)" in content
+    assert "File: b.dos (rank 2)" in content
+    assert "c.dos" not in content
+    assert content.index("a.dos") < content.index("b.dos")
@@ -0,0 +1,12 @@
+import json
+
+from utils.json_parser import dumps_json
+
+
+def test_non_string_keys_are_serialized():
+    assert json.loads(dumps_json({1: "a", "b": 2})) == {"1": "a", "b": 2}
+
+
+def test_values_orjson_rejects_fall_back_to_json():
+    big = 2 ** 70
+    assert json.loads(dumps_json({"value": big}, indent=True, sort_keys=True)) == {"value": big}
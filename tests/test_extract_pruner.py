@@ -0,0 +1,23 @@
+from context.pruner import Document, ExtractPruner
+
+
+def test_small_file_is_kept_whole_and_not_extracted():
+    pruner = ExtractPruner(max_tokens=1000, max_workers=1)
+    small = Document("small.dos", "select * from trades", tokens=100)
+    large = Document("large.dos", "x = 1\n" * 2000, tokens=5000)
+
+    extracted_batches = []
+
+    def fake_process_file_batch(batch, conversations):
+        extracted_batches.append([doc.file_path for doc in batch])
+        return [Document(doc.file_path, "# snippet", tokens=10) for doc in batch]
+
+    pruner._process_file_batch = fake_process_file_batch
+
+    result = pruner.prune([small, large], [{"role": "user", "content": "query trades"}])
+
+    assert extracted_batches == [["large.dos"]]
+    assert result[0] is small
+    assert result[0].source_code == "select * from trades"
+    assert [doc.file_path for doc in result] == ["small.dos", "large.dos"]
+    assert result[1].source_code == "# snippet"
@@ -0,0 +1,53 @@
+import json
+
+from utils.json_parser import JsonArrayStreamParser
+
+
+PLAN = [
+    {"step": 1, "action": "run_dolphindb_script", "args": {"script": "t = table(1..3 as id)"}},
+    {"step": 2, "action": "get_function_signature", "args": {"function_name": "wavg"}},
+    {"step": 3, "action": "run_dolphindb_script", "args": {"script": "select * from t where id in [1, 2]"}},
+]
+
+
+def _feed_all(parser, chunks):
+    completed = []
+    for chunk in chunks:
+        completed.extend(parser.feed(chunk))
+    return completed
+
+
+def test_whole_array_in_one_chunk():
+    assert _feed_all(JsonArrayStreamParser(), [json.dumps(PLAN)]) == PLAN
+
+
+def test_array_split_across_chunks():
+    text = "```json\n" + json.dumps({"plan": PLAN}, indent=2) + "\n```"
+    for size in (1, 3, 7, 64):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert _feed_all(JsonArrayStreamParser(), chunks) == PLAN
+
+
+def test_elements_are_returned_as_soon_as_they_close():
+    text = json.dumps(PLAN)
+    first_end = text.index("}}") + 2
+    parser = JsonArrayStreamParser()
+
+    assert parser.feed(text[:first_end]) == PLAN[:1]
+    assert parser.feed(text[first_end:]) == PLAN[1:]
+
+
+def test_strings_with_brackets_and_escaped_quotes():
+    plan = [
+        {"script": "print(\"[not a bracket}\")", "note": "a \\\" { b"},
+        {"script": "x = \"]}\\\\\"; y = '{['"},
+    ]
+    text = json.dumps(plan)
+    for size in (1, 2, 5):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert _feed_all(JsonArrayStreamParser(), chunks) == plan
+
+
+def test_brackets_before_the_array_are_ignored():
+    text = 'Here is the plan: {"plan": ' + json.dumps(PLAN[:1]) + "}"
+    assert _feed_all(JsonArrayStreamParser(), [text]) == PLAN[:1]
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+from agent.plan_cache import PlanCache
+
+
+def test_roundtrip():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PlanCache(path=os.path.join(tmp, "plan_cache.sqlite3"), enabled=True)
+        cache.put("fingerprint", '[{"step": 1}]')
+
+        assert cache.get("fingerprint") == '[{"step": 1}]'
+        assert cache.get("missing") is None
+        cache.close()
+
+
+def test_unwritable_path_disables_cache():
+    cache = PlanCache(path="/proc/nope/plan_cache.sqlite3", enabled=True)
+
+    assert cache.enabled is False
+    assert cache.get("fingerprint") is None
+    cache.put("fingerprint", "[]")
@@ -0,0 +1,25 @@
+from llm.llm_prompt import _prepend_system_message
+
+
+def test_system_message_is_prepended():
+    messages = [{"role": "user", "content": "hi"}]
+
+    assert _prepend_system_message(messages, "rules") == [
+        {"role": "system", "content": "rules"},
+        {"role": "user", "content": "hi"},
+    ]
+
+
+def test_history_system_message_is_merged_into_one():
+    messages = [
+        {"role": "system", "content": "session notes"},
+        {"role": "user", "content": "hi"},
+    ]
+
+    result = _prepend_system_message(messages, "rules")
+
+    assert result == [
+        {"role": "system", "content": "rules\n\nsession notes"},
+        {"role": "user", "content": "hi"},
+    ]
+    assert [m["role"] for m in result].count("system") == 1
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+from agent.agent import DDBAgent
+
+
+def _steps(*scripts):
+    return [{"action": "run_dolphindb_script", "args": {"script": script}} for script in scripts]
+
+
+def _failure(error):
+    return SimpleNamespace(success=False, error=error)
+
+
+# 计划中的第 3、4、5 步 (start 是 0 起始的下标 2) 被合并执行
+START = 2
+RUN_LENGTH = 3
+
+
+def test_merge_wraps_all_but_last_step_with_their_step_numbers():
+    merged = DDBAgent._merge_script_steps(_steps("a = 1", "b = a + 1", "select * from t"), START)
+
+    assert merged.count("try {") == 2
+    assert '"step_3: "' in merged
+    assert '"step_4: "' in merged
+    assert "step_5" not in merged
+    # 最后一步不包装，整个脚本的值仍是它的值
+    assert merged.endswith("\nselect * from t")
+
+
+def test_failure_in_first_step():
+    result = _failure("Server response: 'step_3: Cannot find table t' script: ...")
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) == 0
+
+
+def test_failure_in_middle_step():
+    result = _failure("Server response: 'step_4: The column [price] doesn't exist.' script: ...")
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) == 1
+
+
+def test_failure_in_last_step():
+    # 最后一步没有 try/catch 包装，错误信息不带步骤前缀
+    result = _failure("Server response: 'The column [qty] doesn't exist.' script: ...")
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) == 2
+
+
+def test_step_number_outside_the_run_is_attributed_to_the_last_step():
+    result = _failure("Server response: 'step_9: unexpected' script: ...")
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) == 2
+
+
+def test_success_maps_to_last_step():
+    result = SimpleNamespace(success=True, error=None)
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) == 2
+
+
+def test_unparseable_merged_script_returns_none():
+    result = _failure("Syntax Error: [line #7] ')' expected")
+
+    assert DDBAgent._failed_script_offset(result, START, RUN_LENGTH) is None
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import agent.agent as agent_module
+from agent.agent import DDBAgent
+from agent.plan_cache import PlanCache
+
+
+def _make_agent():
+    # 只构造 _cached_initial_script 用到的部分，不连接数据库、不加载索引
+    agent = DDBAgent.__new__(DDBAgent)
+    agent.rag = SimpleNamespace(index_version=1.0)
+    agent.plan_cache = PlanCache(enabled=False)
+    agent._initial_script_cache = OrderedDict()
+    agent._initial_script_lock = threading.Lock()
+    agent._script_template_cache = OrderedDict()
+    return agent
+
+
+def _fake_generator(scripts):
+    calls = []
+
+    def generate_initial_script(user_query, rag_context):
+        calls.append(user_query)
+        return scripts[user_query]
+
+    return generate_initial_script, calls
+
+
+def test_same_shape_query_reuses_script_with_new_literals(monkeypatch):
+    generate, calls = _fake_generator({
+        'show the top 10 rows of "trades"': 'select top 10 * from loadTable("dfs://db", "trades")',
+    })
+    monkeypatch.setattr(agent_module, "generate_initial_script", generate)
+    agent = _make_agent()
+
+    first = agent._cached_initial_script('show the top 10 rows of "trades"', "ctx")
+    second = agent._cached_initial_script('show the top 20 rows of "quotes"', "ctx")
+
+    assert first == 'select top 10 * from loadTable("dfs://db", "trades")'
+    assert second == 'select top 20 * from loadTable("dfs://db", "quotes")'
+    assert calls == ['show the top 10 rows of "trades"']
+
+
+def test_structurally_different_query_misses(monkeypatch):
+    generate, calls = _fake_generator({
+        'show the top 10 rows of "trades"': 'select top 10 * from loadTable("dfs://db", "trades")',
+        'count the rows of "trades" per day': 'select count(*) from loadTable("dfs://db", "trades") group by date',
+    })
+    monkeypatch.setattr(agent_module, "generate_initial_script", generate)
+    agent = _make_agent()
+
+    agent._cached_initial_script('show the top 10 rows of "trades"', "ctx")
+    script = agent._cached_initial_script('count the rows of "trades" per day', "ctx")
+
+    assert script == 'select count(*) from loadTable("dfs://db", "trades") group by date'
+    assert calls == ['show the top 10 rows of "trades"', 'count the rows of "trades" per day']
+
+
+def test_different_rag_context_misses(monkeypatch):
+    generate, calls = _fake_generator({
+        'show the top 10 rows of "trades"': 'select top 10 * from loadTable("dfs://db", "trades")',
+        'show the top 20 rows of "quotes"': 'select top 20 * from loadTable("dfs://other", "quotes")',
+    })
+    monkeypatch.setattr(agent_module, "generate_initial_script", generate)
+    agent = _make_agent()
+
+    agent._cached_initial_script('show the top 10 rows of "trades"', "ctx")
+    script = agent._cached_initial_script('show the top 20 rows of "quotes"', "other ctx")
+
+    assert script == 'select top 20 * from loadTable("dfs://other", "quotes")'
+    assert len(calls) == 2
@@ -0,0 +1,31 @@
+from agent.semantic_cache import SemanticCache
+
+
+def test_near_identical_query_hits():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("show the schema of table trades", "answer", namespace="chat")
+
+    assert cache.lookup("Show the schema of table trades?", namespace="chat") == "answer"
+
+
+def test_permuted_query_misses():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("copy all rows from table trades into table quotes", "trades -> quotes", namespace="chat")
+
+    assert cache.lookup("copy all rows from table quotes into table trades", namespace="chat") is None
+
+
+def test_different_context_misses():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("explain it", "answer about conversation A", namespace="chat", context="conversation-a")
+
+    assert cache.lookup("explain it", namespace="chat", context="conversation-b") is None
+    assert cache.lookup("explain it", namespace="chat", context="conversation-a") == "answer about conversation A"
+
+
+def test_clear_drops_entries():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("show the schema of table trades", "answer", namespace="chat")
+    cache.clear()
+
+    assert cache.lookup("show the schema of table trades", namespace="chat") is None
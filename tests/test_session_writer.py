@@ -0,0 +1,38 @@
+import json
+
+from session.session_manager import SessionWriter
+
+
+def test_failed_write_keeps_the_previous_session_file(tmp_path):
+    path = tmp_path / "session.json"
+    writer = SessionWriter()
+    writer.enqueue(str(path), {"conversation_history": ["first"]})
+    writer.flush()
+
+    # set 无法序列化为 JSON，写入失败
+    writer.enqueue(str(path), {"conversation_history": {"not serializable"}})
+    writer.flush()
+
+    assert json.loads(path.read_text(encoding="utf-8")) == {"conversation_history": ["first"]}
+    assert not (tmp_path / "session.json.tmp").exists()
+
+
+def test_unexpected_error_does_not_block_flush(tmp_path):
+    writer = SessionWriter()
+    calls = []
+
+    def broken_write(path, snapshot):
+        calls.append(path)
+        raise RuntimeError("boom")
+
+    writer._write = broken_write
+    writer.enqueue(str(tmp_path / "a.json"), {})
+    writer.flush()
+
+    # 写盘线程仍然存活，之后的快照照常写入
+    del writer._write
+    writer.enqueue(str(tmp_path / "b.json"), {"ok": True})
+    writer.flush()
+
+    assert calls == [str(tmp_path / "a.json")]
+    assert json.loads((tmp_path / "b.json").read_text(encoding="utf-8")) == {"ok": True}
@@ -1,14 +1,19 @@
 # file: ddb_agent/token_counter.py
 
+import hashlib
 import os
-from typing import Dict, Optional, Callable
-from functools import lru_cache
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Callable
 import transformers
 
 # --- Tokenizer 注册表和加载器 ---
 
 # 1. 注册表：存储已加载的Tokenizer实例
-_tokenizer_cache: Dict[str, transformers.PreTrainedTokenizer] = {}
+#    找不到 tokenizer 的模型也会以 None 缓存，避免每次调用都重新探测路径、重复打印警告
+_tokenizer_cache: Dict[str, Optional[transformers.PreTrainedTokenizer]] = {}
+# 加载 tokenizer 很慢 (数百毫秒)，并发线程 (如 ExtractPruner 的线程池) 只应加载一次
+_tokenizer_lock = threading.Lock()
 
 # 2. Tokenizer加载函数定义
 #    这是一个可扩展的设计，我们可以为不同类型的模型定义不同的加载函数
@@ -56,6 +61,16 @@ def get_tokenizer(model_name: str) -> Optional[transformers.PreTrainedTokenizer]
     if model_name in _tokenizer_cache:
         return _tokenizer_cache[model_name]
 
+    with _tokenizer_lock:
+        # 双重检查：等待锁期间，其他线程可能已经完成了加载
+        if model_name in _tokenizer_cache:
+            return _tokenizer_cache[model_name]
+        tokenizer = _load_tokenizer(model_name)
+        _tokenizer_cache[model_name] = tokenizer
+        return tokenizer
+
+def _load_tokenizer(model_name: str) -> Optional[transformers.PreTrainedTokenizer]:
+    """根据 TOKENIZER_CONFIGS 加载 tokenizer，失败时返回 None。"""
     config = TOKENIZER_CONFIGS.get(model_name)
     if not config:
         #print(f"Warning: No tokenizer configuration found for model '{model_name}'. "
@@ -70,9 +85,7 @@ def get_tokenizer(model_name: str) -> Optional[transformers.PreTrainedTokenizer]
         return None
 
     try:
-        tokenizer = loader_func(path)
-        _tokenizer_cache[model_name] = tokenizer
-        return tokenizer
+        return loader_func(path)
     except Exception as e:
         print(f"Error getting tokenizer for model '{model_name}': {e}")
         return None
@@ -80,11 +93,45 @@ def get_tokenizer(model_name: str) -> Optional[transformers.PreTrainedTokenizer]
 
 # --- 统一的 Token 计数接口 ---
 
-# 使用 lru_cache 进一步对计数结果进行缓存，提高对相同文本计数的性能
-@lru_cache(maxsize=1024)
+# 计数结果的缓存 (LRU)：
+#   - 短文本 (对话消息等) 直接以文本为键
+#   - 长文本 (整个源文件) 以内容哈希为键，避免缓存本身长期持有大字符串
+_LARGE_TEXT_CHARS = 16384
+_TOKEN_CACHE_SIZE = 8192
+_token_cache: "OrderedDict[tuple, int]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# 很短的纯 ASCII 文本 ("ok"、"yes"、简短的回复) 不经过 tokenizer，按约 4 字符/token 估算；
+# 含括号等结构化字符的文本 (JSON、代码、标签) 分词结果偏差大，仍然走 tokenizer
+_SHORT_TEXT_CHARS = 32
+_STRUCTURED_CHARS = frozenset('{[<')
+
+def _short_text_tokens(text: str) -> Optional[int]:
+    if len(text) < _SHORT_TEXT_CHARS and text.isascii() and _STRUCTURED_CHARS.isdisjoint(text):
+        return max(1, (len(text) + 3) // 4)
+    return None
+
+def _cache_key(text: str, model_name: str) -> tuple:
+    if len(text) <= _LARGE_TEXT_CHARS:
+        return (text, model_name)
+    return (hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest(), model_name)
+
+def _cache_get(key: tuple) -> Optional[int]:
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            _token_cache.move_to_end(key)
+        return cached
+
+def _cache_put(key: tuple, value: int):
+    with _token_cache_lock:
+        _token_cache[key] = value
+        if len(_token_cache) > _TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
 def count_tokens(text: str, model_name: str = "deepseek-default") -> int:
     """
-    计算给定文本的 token 数量。
+    计算给定文本的 token 数量。结果按文本内容缓存，相同内容只分词一次。
 
     Args:
         text: 要计算 token 的文本。
@@ -94,6 +141,47 @@ def count_tokens(text: str, model_name: str = "deepseek-default") -> int:
     Returns:
         token 的数量。如果找不到对应的 tokenizer，则会基于字符数进行粗略估算。
     """
+    short = _short_text_tokens(text)
+    if short is not None:
+        return short
+    key = _cache_key(text, model_name)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    result = _count_tokens_uncached(text, model_name)
+    _cache_put(key, result)
+    return result
+
+def count_tokens_batch(texts: List[str], model_name: str = "deepseek-default") -> List[int]:
+    """
+    计算一组文本各自的 token 数量，结果与逐条调用 count_tokens 相同。
+
+    未命中缓存的文本通过一次批量分词调用完成计数，避免逐条调用 tokenizer 的开销。
+    """
+    results: List[Optional[int]] = [_short_text_tokens(text) for text in texts]
+    keys = [_cache_key(text, model_name) if value is None else None for text, value in zip(texts, results)]
+    results = [value if value is not None else _cache_get(key) for value, key in zip(results, keys)]
+    missing = [i for i, value in enumerate(results) if value is None]
+    if not missing:
+        return results
+
+    tokenizer = get_tokenizer(model_name)
+    lengths = None
+    if tokenizer and len(missing) > 1:
+        try:
+            # 与 tokenizer.encode 使用相同的默认参数，保证计数与 count_tokens 一致
+            input_ids = tokenizer([texts[i] for i in missing])["input_ids"]
+            lengths = [len(ids) for ids in input_ids]
+        except Exception as e:
+            print(f"Error batch-encoding texts with tokenizer for '{model_name}': {e}")
+
+    for n, i in enumerate(missing):
+        value = lengths[n] if lengths is not None else _count_tokens_uncached(texts[i], model_name)
+        _cache_put(keys[i], value)
+        results[i] = value
+    return results
+
+def _count_tokens_uncached(text: str, model_name: str) -> int:
     tokenizer = get_tokenizer(model_name)
 
     if tokenizer:
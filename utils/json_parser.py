@@ -1,19 +1,143 @@
 import datetime
 import json
 import os
+import re
+
+# orjson 是可选依赖，比标准库 json 快数倍；未安装时退回到 json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# google-re2 是可选依赖：基于自动机匹配，不会出现回溯爆炸；未安装时使用标准库 re
+try:
+    import re2 as _block_re
+    RE2_AVAILABLE = True
+except ImportError:
+    _block_re = re
+    RE2_AVAILABLE = False
+
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x1F\x7F]')
+# LLM 输出中被 ``` / ```json 包裹的 JSON 块 (前后可能还有说明文字)
+_JSON_BLOCK_RE = _block_re.compile(r'(?s)```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```')
+
+
+def dumps_json(obj, indent: bool = False, sort_keys: bool = False) -> str:
+    """Serializes `obj` to a JSON string, using orjson when it is available."""
+    if ORJSON_AVAILABLE:
+        # 与 json 一样接受 int 等非字符串的键
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option).decode('utf-8')
+        except TypeError:
+            # orjson 不支持的输入 (如超过 64 位的整数、混合类型的键排序) 交给标准库 json 处理
+            pass
+    return json.dumps(obj, indent=2 if indent else None, sort_keys=sort_keys, ensure_ascii=False)
+
+
+class JsonArrayStreamParser:
+    """
+    Incrementally extracts the objects of the first JSON array in streamed text
+    (e.g. an LLM plan arriving chunk by chunk, either bare or wrapped as
+    `{"plan": [...]}`), so each element can be used as soon as its closing
+    brace arrives. Text before the array (such as a ```json fence) is ignored. The complete text should still be parsed with
+    `parse_json_string` once the stream ends.
+    """
+    def __init__(self):
+        self._depth = 0
+        # 第一个数组所在的嵌套深度 (数组内部)，尚未遇到数组时为 None
+        self._array_depth = None
+        self._in_string = False
+        self._escaped = False
+        # 当前未完成元素在之前的文本块中的部分；只保留这一个元素的文本，
+        # 每个元素完成时只拼接它自己，整体是线性的
+        self._object_parts: list = []
+        self._in_object = False
+
+    def feed(self, chunk: str) -> list:
+        """Consumes `chunk` and returns the array elements completed by it."""
+        completed = []
+        # 当前元素在本块中的起始位置 (元素始于之前的块时为 0)
+        object_start = 0
+        for offset, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char in '[{':
+                self._depth += 1
+                if char == '[' and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif char == '{' and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._in_object = True
+                    self._object_parts = []
+                    object_start = offset
+            elif char in ']}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == self._array_depth and char == '}' and self._in_object:
+                    self._object_parts.append(chunk[object_start:offset + 1])
+                    try:
+                        completed.append(json.loads("".join(self._object_parts)))
+                    except json.JSONDecodeError:
+                        pass
+                    self._in_object = False
+                    self._object_parts = []
+        if self._in_object:
+            self._object_parts.append(chunk[object_start:])
+        return completed
+
 
 def parse_json_string(json_str):
-    # 去掉 JSON 字符串的 ```json 和 ``` 标记部分
-    json_str  = json_str.lstrip().rstrip()  # 去掉首尾空白字符
-    if json_str.startswith('```json'):
-        json_str = json_str[7:]  # 去掉开头的 ```json
-    if json_str.endswith('```'):
-        json_str = json_str[:-3]  # 去掉结尾的 ```
+    # 最快路径：输出本身就是合法的 JSON (例如 JSON 输出模式)，不做任何预处理直接解析；
+    # bytes 输入直接交给 orjson，省去一次 UTF-8 解码
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(json_str, (bytes, bytearray)):
+        json_str = json_str.decode('utf-8')
+    if not ORJSON_AVAILABLE:
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            pass
+
+    json_str = json_str.strip()  # 去掉首尾空白字符
+    if not json_str.startswith(('{', '[')):
+        # 优先用预编译的正则直接定位 ``` 包裹的 JSON 块
+        match = _JSON_BLOCK_RE.search(json_str)
+        if match:
+            json_str = match.group(1)
+        else:
+            # 去掉 JSON 字符串的 ```json 和 ``` 标记部分
+            if json_str.startswith('```json'):
+                json_str = json_str[7:]  # 去掉开头的 ```json
+            if json_str.endswith('```'):
+                json_str = json_str[:-3]  # 去掉结尾的 ```
+
+    # 去掉代码块标记后再试一次快速路径
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            pass
 
     # 解析 JSON 字符串
+    cleaned_json_str = json_str
     try:
-        import re
-        cleaned_json_str = re.sub(r'[\x00-\x1F\x7F]', '', json_str)
+        cleaned_json_str = _CONTROL_CHARS_RE.sub('', json_str)
 
         data = json.loads(cleaned_json_str)
         return data
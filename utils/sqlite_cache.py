@@ -0,0 +1,117 @@
+# file: utils/sqlite_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class SQLiteCache:
+    """
+    A persistent key-value cache stored in a SQLite file, shared by the plan cache
+    (agent/plan_cache.py) and the snippet extraction cache (context/pruner.py).
+
+    Values are strings keyed by a fingerprint (a hash of everything the cached
+    result depended on). Entries expire after `ttl_seconds` and are evicted in
+    LRU order once the stored values exceed `max_bytes`. If the file cannot be
+    opened (e.g. a read-only or missing cache directory), the cache disables
+    itself and every lookup misses.
+    """
+    DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+    DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        enabled: bool = True
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.DEFAULT_TTL_SECONDS
+        self.max_bytes = max_bytes if max_bytes is not None else self.DEFAULT_MAX_BYTES
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        if self.enabled:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # 连接在多个线程间共享，访问由 self._lock 串行化
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                # 表名和列名沿用最初的计划缓存，已有的缓存文件继续有效
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS plan_cache ("
+                    "fingerprint TEXT PRIMARY KEY, plan_json BLOB, ts INTEGER)"
+                )
+                self._conn.commit()
+            except (sqlite3.Error, OSError) as e:
+                # 缓存目录不可写或不存在 (如只读 HOME、容器) 时只是禁用缓存，不影响调用方
+                print(f"Warning: Could not open cache at '{self.path}', caching disabled: {e}")
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = None
+                self.enabled = False
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Returns the cached value for `fingerprint`, or None if it is missing or expired."""
+        if self._conn is None:
+            return None
+        now = int(time.time())
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT plan_json FROM plan_cache WHERE fingerprint = ? AND ts >= ?",
+                    (fingerprint, now - self.ttl_seconds)
+                ).fetchone()
+                if row is None:
+                    return None
+                # 命中时刷新时间戳，淘汰时按最近使用的顺序保留
+                self._conn.execute("UPDATE plan_cache SET ts = ? WHERE fingerprint = ?", (now, fingerprint))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Cache read failed: {e}")
+                return None
+        value = row[0]
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def put(self, fingerprint: str, value: str):
+        """Stores `value` under `fingerprint` and evicts expired or least recently used entries."""
+        if self._conn is None:
+            return
+        now = int(time.time())
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO plan_cache (fingerprint, plan_json, ts) VALUES (?, ?, ?)",
+                    (fingerprint, value.encode('utf-8'), now)
+                )
+                self._conn.execute("DELETE FROM plan_cache WHERE ts < ?", (now - self.ttl_seconds,))
+                total_bytes = self._conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(plan_json)), 0) FROM plan_cache"
+                ).fetchone()[0]
+                if total_bytes > self.max_bytes:
+                    self._evict(total_bytes)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Cache write failed: {e}")
+
+    def _evict(self, total_bytes: int):
+        """Deletes the least recently used entries until the cache fits in `max_bytes`."""
+        doomed = []
+        for fingerprint, size in self._conn.execute(
+            "SELECT fingerprint, LENGTH(plan_json) FROM plan_cache ORDER BY ts ASC"
+        ):
+            if total_bytes <= self.max_bytes:
+                break
+            doomed.append((fingerprint,))
+            total_bytes -= size
+        self._conn.executemany("DELETE FROM plan_cache WHERE fingerprint = ?", doomed)
+
+    def close(self):
+        """Closes the underlying SQLite connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,44 @@
+# file: utils/text_lines.py
+
+import io
+from typing import List
+
+def line_starts(text: str, max_lines: int) -> List[int]:
+    """
+    Returns the start offsets of the first `max_lines` lines of `text`, plus one
+    sentinel entry (end of the last returned line + 1), so that line i spans
+    text[starts[i]:starts[i + 1] - 1].
+    """
+    starts = [0]
+    pos = 0
+    while len(starts) <= max_lines:
+        nl = text.find("\n", pos)
+        if nl == -1:
+            if pos < len(text):
+                starts.append(len(text) + 1)
+            break
+        pos = nl + 1
+        starts.append(pos)
+    return starts
+
+def number_lines(text: str) -> str:
+    """
+    Prefixes every line of `text` with its 1-based line number, writing slices of
+    the original string into one buffer instead of splitting it into a list of lines.
+    Lines are split on '\n', the same way `line_starts` counts them.
+    """
+    buf = io.StringIO()
+    start = 0
+    line_no = 1
+    length = len(text)
+    while start < length:
+        end = text.find("\n", start)
+        if end == -1:
+            end = length
+        if line_no > 1:
+            buf.write("\n")
+        buf.write(f"{line_no} ")
+        buf.write(text[start:end])
+        start = end + 1
+        line_no += 1
+    return buf.getvalue()
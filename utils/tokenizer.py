@@ -1,7 +1,7 @@
 # file: utils/tokenizer.py
 
 import re
-from typing import Set
+from typing import List, Set
 
 # 尝试导入 jieba，如果失败则给出提示
 try:
@@ -12,12 +12,15 @@ except ImportError:
     print("Warning: `jieba` library not found. Chinese tokenization will be suboptimal. "
           "Please install it with `pip install jieba`.")
 
+# \u4e00-\u9fa5 是中文字符的Unicode范围
+_CHINESE_CHAR_RE = re.compile(r'[\u4e00-\u9fa5]')
+_WORD_RE = re.compile(r'\w+')
+
 def is_contains_chinese(text: str) -> bool:
     """
     Checks if a string contains any Chinese characters.
     """
-    # \u4e00-\u9fa5 是中文字符的Unicode范围
-    return bool(re.search(r'[\u4e00-\u9fa5]', text))
+    return _CHINESE_CHAR_RE.search(text) is not None
 
 def smart_tokenize(text: str) -> Set[str]:
     """
@@ -37,4 +40,16 @@ def smart_tokenize(text: str) -> Set[str]:
         return {token for token in tokens if len(token.strip()) > 1}
     else:
         # 对纯英文使用正则表达式
-        return set(re.findall(r'\w+', text_lower))
\ No newline at end of file
+        return set(_WORD_RE.findall(text_lower))
+
+def tokenize_sequence(text: str) -> List[str]:
+    """
+    Like `smart_tokenize`, but returns the lowercased tokens as a list in their
+    original order (with repeats), for callers where word order matters.
+    """
+    text_lower = text.lower()
+
+    if JIEBA_AVAILABLE and is_contains_chinese(text):
+        # 精确模式：cut_for_search 会输出相互重叠的子词，不能反映词序
+        return [token for token in jieba.cut(text_lower) if len(token.strip()) > 1]
+    return _WORD_RE.findall(text_lower)